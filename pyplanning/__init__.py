@@ -2,6 +2,9 @@ from . import pddl
 from . import action
 from . import logic
 from . import strips
+from . import grounding
+from . import taskfile
 from . import solvers
 
-from .pddl import load_pddl
\ No newline at end of file
+from .pddl import load_pddl
+from .taskfile import load_compiled
\ No newline at end of file
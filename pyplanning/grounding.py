@@ -0,0 +1,378 @@
+from .logic import AND, NOT, OR, Predicate
+from .strips import AtomTable, BitKnowledgeState, Problem
+
+
+class GroundedOperator:
+    """
+    A fully grounded action over integer atom ids. Preconditions are split
+    into positive (pre) and negative (neg) atoms, effects into add and
+    delete atoms. Only the ids are stored, so the memory of an operator
+    does not grow with the size of the atom table; masks are built on
+    request for the analyses that need them.
+    """
+
+    __slots__ = ["index", "name", "objects", "action", "pre", "neg", "add", "delete"]
+
+    def __init__(self, index, name, objects, pre, neg, add, delete, action=None):
+        self.index = index
+        self.name = name
+        self.objects = tuple(objects)
+        self.action = action
+        self.pre = tuple(dict.fromkeys(pre))
+        self.neg = tuple(dict.fromkeys(neg))
+        self.add = tuple(dict.fromkeys(add))
+        self.delete = tuple(dict.fromkeys(delete))
+
+    def __repr__(self) -> str:
+        return "{}({})".format(self.name, ", ".join([str(o) for o in self.objects]))
+
+    @property
+    def pre_mask(self):
+        return ids_to_mask(self.pre)
+
+    @property
+    def neg_mask(self):
+        return ids_to_mask(self.neg)
+
+    @property
+    def add_mask(self):
+        return ids_to_mask(self.add)
+
+    @property
+    def del_mask(self):
+        return ids_to_mask(self.delete)
+
+    def applicable(self, bits):
+        for a in self.pre:
+            if not (bits >> a) & 1:
+                return False
+        return not self.violates_neg(bits)
+
+    def violates_neg(self, bits):
+        """
+        Returns whether an atom of the negative preconditions holds
+        """
+        for a in self.neg:
+            if (bits >> a) & 1:
+                return True
+        return False
+
+    def apply(self, bits):
+        for a in self.delete:
+            if (bits >> a) & 1:
+                bits ^= 1 << a
+        for a in self.add:
+            bits |= 1 << a
+        return bits
+
+    def ground(self):
+        """
+        Returns the GroundedAction for this operator, or the operator
+        itself if it is not attached to a domain action
+        """
+        if self.action is None:
+            return self
+        return self.action.ground(self.objects)
+
+
+class GroundedTask:
+    """
+    A Problem compiled to integer atoms and grounded operators. The goal
+    is stored in disjunctive normal form as a list of (positive, negative)
+    bitmask pairs.
+    """
+
+    def __init__(self, atoms, operators, init, goals):
+        self.atoms = atoms
+        self.operators = operators
+        self.init = init
+        self.goals = goals
+        self.successor_generator = None  # Built on first use by get_successor_generator
+
+    def __len__(self):
+        return len(self.operators)
+
+    def is_goal(self, bits):
+        for pos, neg in self.goals:
+            if (bits & pos) == pos and not (bits & neg):
+                return True
+        return False
+
+    def goal_atoms(self):
+        """
+        Returns the positive goal atom ids of a conjunctive goal
+        """
+        if len(self.goals) != 1:
+            raise TypeError("Goal state must be a conjunction of literals.")
+        return mask_to_ids(self.goals[0][0])
+
+    def initial_state(self):
+        return BitKnowledgeState(self.atoms, self.init)
+
+    def state(self, bits):
+        return BitKnowledgeState(self.atoms, bits)
+
+    def encode(self, state):
+        """
+        Returns the bitset of a state, which may be an int, a
+        BitKnowledgeState over the same atom table or a KnowledgeState
+        """
+        if isinstance(state, int):
+            return state
+        if isinstance(state, BitKnowledgeState) and state.atoms is self.atoms:
+            return state.bits
+        bits = 0
+        for k in state.knowledge:
+            if isinstance(k, Predicate):
+                idx = self.atoms.find(k)
+                if idx is not None:
+                    bits |= 1 << idx
+        return bits
+
+
+def get_task(problem: Problem):
+    """
+    Returns the compiled task of the problem, compiling it on first use
+    """
+    if problem.task is None:
+        problem.task = compile_task(problem)
+    return problem.task
+
+
+def compile_task(problem: Problem):
+    """
+    Ground every action of the problem once into integer operators.
+    Preconditions on static predicates are evaluated against the initial
+    state while parameters are bound, and only operators reachable in the
+    delete relaxation of the problem are materialized.
+    """
+    domain = problem.domain
+    atoms = problem.atoms
+    init = problem.encode_state(problem.initial_state).bits
+    init_keys = set(atoms.keys[i] for i in mask_to_ids(init))
+
+    static, schemas = get_schemas(domain)
+    static_true = set(k for k in init_keys if k[0] in static)
+
+    candidates = []
+    for a, checks, pos, neg, add, delete in schemas:
+        domains = [problem.get_typed_objs(t) for t in a.types]
+        for objs in bind_parameters(domains, checks, static_true):
+            candidates.append((a, objs,
+                               [bind_spec(s, objs) for s in pos],
+                               [bind_spec(s, objs) for s in neg],
+                               [bind_spec(s, objs) for s in add],
+                               [bind_spec(s, objs) for s in delete]))
+
+    # Relaxed reachability with a counter of unreached preconditions per candidate
+    reached = set(init_keys)
+    waiting = {}
+    counters = []
+    queue = []
+    for i, c in enumerate(candidates):
+        missing = set(k for k in c[2] if k not in reached)
+        counters.append(len(missing))
+        for k in missing:
+            waiting.setdefault(k, []).append(i)
+        if len(missing) == 0:
+            queue.append(i)
+    reachable = []
+    while len(queue) > 0:
+        i = queue.pop()
+        reachable.append(i)
+        for k in candidates[i][4]:
+            if k in reached:
+                continue
+            reached.add(k)
+            for j in waiting.pop(k, []):
+                counters[j] -= 1
+                if counters[j] == 0:
+                    queue.append(j)
+
+    operators = []
+    for i in sorted(reachable):
+        a, objs, pre, neg, add, delete = candidates[i]
+        operators.append(GroundedOperator(
+            len(operators), a.name, objs,
+            [atoms.intern_key(k) for k in pre],
+            [atoms.intern_key(k) for k in neg if k in reached],
+            [atoms.intern_key(k) for k in add],
+            [atoms.intern_key(k) for k in delete if k in reached],
+            a))
+
+    goals = []
+    for pos, neg in dnf(problem.goal_state):
+        pos_keys = [AtomTable.key(p) for p in pos]
+        neg_keys = [AtomTable.key(p) for p in neg]
+        if any(k[0] in static and k not in static_true for k in pos_keys):
+            continue
+        if any(k[0] in static and k in static_true for k in neg_keys):
+            continue
+        goals.append((ids_to_mask([atoms.intern_key(k) for k in pos_keys]),
+                      ids_to_mask([atoms.intern_key(k) for k in neg_keys])))
+
+    return GroundedTask(atoms, operators, init, goals)
+
+
+def get_schemas(domain):
+    """
+    Returns the static predicates and the lifted operator schemas of the
+    domain, computing them on first use so that they are shared by all
+    problems of the domain
+    """
+    if domain.schemas is None:
+        domain.schemas = compile_schemas(domain)
+    return domain.schemas
+
+
+def compile_schemas(domain):
+    """
+    Splits every action into one schema per disjunct of its precondition.
+    A schema holds the action, the static precondition checks indexed by
+    the number of parameters they need, the remaining positive and
+    negative preconditions and the add and delete effects as lifted atoms.
+    """
+    static = find_static_predicates(domain)
+    schemas = []
+    for a in domain.actions.values():
+        params = {p: i for i, p in enumerate(a.parameters)}
+        if a.effect is None:
+            add, delete = [], []
+        else:
+            add, delete = split_literals(a.effect.props)
+        add = [literal_spec(p, params) for p in add]
+        delete = [literal_spec(p, params) for p in delete]
+
+        disjuncts = [([], [])] if a.precondition is None else dnf(a.precondition)
+        for pos, neg in disjuncts:
+            pos = [literal_spec(p, params) for p in pos]
+            neg = [literal_spec(p, params) for p in neg]
+            checks = [[] for _ in range(len(a.parameters) + 1)]
+            for spec in pos:
+                if spec[0] in static:
+                    checks[spec_depth(spec)].append((spec, True))
+            for spec in neg:
+                if spec[0] in static:
+                    checks[spec_depth(spec)].append((spec, False))
+            schemas.append((a, checks,
+                            [s for s in pos if s[0] not in static],
+                            [s for s in neg if s[0] not in static],
+                            add, delete))
+    return static, schemas
+
+
+def find_static_predicates(domain):
+    """
+    Returns the names of predicates that no action effect modifies
+    """
+    static = set(domain.predicates.keys())
+    for a in domain.actions.values():
+        if a.effect is None:
+            continue
+        for prop in a.effect.props:
+            if isinstance(prop, NOT):
+                prop = prop.prop
+            static.discard(prop.name)
+    return static
+
+
+def dnf(prop, negated=False):
+    """
+    Returns the disjunctive normal form of a proposition as a list of
+    (positive predicates, negative predicates) pairs
+    """
+    if isinstance(prop, Predicate):
+        return [([], [prop])] if negated else [([prop], [])]
+    elif isinstance(prop, NOT):
+        return dnf(prop.prop, not negated)
+    elif isinstance(prop, AND) or isinstance(prop, OR):
+        parts = [dnf(p, negated) for p in prop.props]
+        if isinstance(prop, AND) != negated:
+            result = [([], [])]
+            for part in parts:
+                result = [(p1 + p2, n1 + n2) for p1, n1 in result for p2, n2 in part]
+            return result
+        return [d for part in parts for d in part]
+    else:
+        raise TypeError("Input must be of type Proposition.")
+
+
+def split_literals(props):
+    add = []
+    delete = []
+    for p in props:
+        if isinstance(p, NOT):
+            delete.append(p.prop)
+        else:
+            add.append(p)
+    return add, delete
+
+
+def literal_spec(pred, params):
+    """
+    Returns a lifted atom as a tuple of its name followed by either
+    the parameter index or the constant object of each argument
+    """
+    spec = [pred.name]
+    for v in pred.variables:
+        if v in pred.grounding:
+            spec.append((None, pred.grounding[v]))
+        elif v in params:
+            spec.append((params[v], None))
+        else:
+            raise ValueError("Free variable {} in action {}".format(v, pred))
+    return tuple(spec)
+
+
+def spec_depth(spec):
+    depth = 0
+    for idx, _ in spec[1:]:
+        if idx is not None:
+            depth = max(depth, idx + 1)
+    return depth
+
+
+def bind_spec(spec, objs):
+    return (spec[0],) + tuple(o if idx is None else objs[idx] for idx, o in spec[1:])
+
+
+def bind_parameters(domains, checks, static_true, objs=()):
+    """
+    Enumerates parameter assignments with distinct objects, testing each
+    static precondition as soon as all of its parameters are bound
+    """
+    depth = len(objs)
+    for spec, positive in checks[depth]:
+        if (bind_spec(spec, objs) in static_true) != positive:
+            return
+    if depth == len(domains):
+        yield objs
+        return
+    for o in domains[depth]:
+        if o in objs:
+            continue
+        yield from bind_parameters(domains, checks, static_true, objs + (o,))
+
+
+def ids_to_mask(ids):
+    ids = list(ids)
+    if len(ids) < 64:
+        mask = 0
+        for i in ids:
+            mask |= 1 << i
+        return mask
+    # Set in a byte buffer, as every OR on a wide int copies it
+    buf = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def mask_to_ids(mask):
+    ids = []
+    digits = bin(mask)[:1:-1]  # Binary digits from the lowest bit up
+    i = digits.find("1")
+    while i != -1:
+        ids.append(i)
+        i = digits.find("1", i + 1)
+    return ids
@@ -1,8 +1,9 @@
 from .logic import AND, NOT, OR, Predicate
 from .action import Action
-from .utils import TextTree, TypeTree
+from .utils import TextTree, TextTreeNode, TypeTree, expect_end, parse_expression, read_chunks, tokenize
 import re
-from .strips import Domain, KnowledgeState, Problem
+from .strips import AtomTable, BitKnowledgeState, Domain, Problem
+from .grounding import ids_to_mask
 
 supported_requirements = {":strips", ":typing", ":disjunctive-preconditions", ":negative-preconditions"}
 
@@ -13,79 +14,127 @@ def load_pddl(domain_file, problem_file):
     return domain, problem
 
 
-def strip_comments(lines):
-    strip_comments = []
-    for l in lines:
-        idx = l.find(";")
-        if idx == -1:
-            strip_comments.append(l)
-        else:
-            strip_comments.append(l[:idx])
-    return strip_comments
-
-
 def load_textTree(text_file):
-    all_text = ""
     with open(text_file, "r") as df:
-        lines = df.readlines()
-        lines = strip_comments(lines)
-        all_text = ''.join(lines)
-    all_text = all_text.replace('\r', '').replace('\n', '')
-    return TextTree(all_text)
+        return TextTree(tokens=tokenize(read_chunks(df)))
 
 
 def load_problem(domain, problem_file):
-    t = load_textTree(problem_file)
-    if t.root.text.replace(" ", "").lower() != "define":
+    """
+    Loads a problem while streaming through the file. The :objects and
+    :init sections are read token by token, and the facts of the initial
+    state are interned straight into the atom table of the problem.
+    """
+    with open(problem_file, "r") as pf:
+        return parse_problem(domain, tokenize(read_chunks(pf)))
+
+
+def parse_problem(domain, tokens):
+    token, line, column = next_token(tokens)
+    if token != "(" or next_token(tokens)[0].lower() != "define":
         raise SyntaxError("Incorrectly formatted PDDL file.")
 
     problem_name = ""
     objects = {}
-    initial_state = KnowledgeState()
+    atoms = AtomTable(domain.predicates)
+    initial = 0
     goal_state = None
 
-    for child in t.root.children:
-        text_split = list(filter(None, child.text.split()))
+    for token, line, column in tokens:
+        if token == ")":
+            expect_end(tokens)
+            break
+        if token != "(":
+            raise SyntaxError("Unexpected '{}' at line {}, column {}.".format(token, line, column))
+        keyword = next_token(tokens)[0]
 
-        if text_split[0].lower() == "problem":
-            problem_name = text_split[1]
-        elif text_split[0].lower() == ":domain":
-            domain_name = text_split[1]
+        if keyword.lower() == "problem":
+            problem_name = read_words(tokens)[0]
+        elif keyword.lower() == ":domain":
+            domain_name = read_words(tokens)[0]
             if domain_name != domain.name:
                 raise SyntaxError(
                     "Domain supplied in problem file does not match the domain supplied in the domain file.")
-        elif text_split[0].lower() == ":objects":
+        elif keyword.lower() == ":objects":
             objs = []
-            skip_next = True
+            text_split = read_words(tokens)
+            skip_next = False
             for i, o in enumerate(text_split):
                 if skip_next:
                     skip_next = False
                 elif o == "-":
-                    objects[text_split[i+1]] = objs
+                    objects.setdefault(text_split[i+1], []).extend(objs)
                     objs = []
                     skip_next = True
                 else:
                     objs.append(o)
             if len(objs) != 0:
-                objects[None] = objs
-        elif text_split[0].lower() == ":init":
-            initial = []
-            for pred in child.children:
-                i = grounded_pred_from_str(pred.text, domain.predicates.values())
-                if i.check_grounded():
-                    initial.append(i)
-                else:
-                    raise SyntaxError(
-                        "Initial state must be completely grounded.")
-            initial_state = initial_state.teach(initial)
-        elif text_split[0].lower() == ":goal":
-            goal_state = process_proposition_nodes(child.children[0], domain.predicates.values())
+                objects.setdefault(None, []).extend(objs)
+        elif keyword.lower() == ":init":
+            initial |= load_init(tokens, domain.predicates, atoms, line, column)
+        elif keyword.lower() == ":goal":
+            node = parse_expression(tokens, TextTreeNode(None, line, column), [keyword])
+            if len(node.children) != 1:
+                raise SyntaxError("Goal must be a single proposition at {}.".format(node.location()))
+            goal_state = process_proposition_nodes(node.children[0], domain.predicates)
             if not goal_state.check_grounded():
-                raise SyntaxError("Goal state must be completely grounded.")
+                raise SyntaxError("Goal state must be completely grounded at {}.".format(node.location()))
         else:
-            raise SyntaxError("Unrecognized keyword: {}".format(text_split[0]))
+            raise SyntaxError("Unrecognized keyword: {} at line {}, column {}".format(keyword, line, column))
+    else:
+        raise SyntaxError("Unclosed '(' of the problem definition.")
+
+    return Problem(problem_name, domain, objects, BitKnowledgeState(atoms, initial), goal_state)
+
 
-    return Problem(problem_name, domain, objects, initial_state, goal_state)
+def load_init(tokens, predicates, atoms, line, column):
+    """
+    Reads the facts of an :init section up to its closing parenthesis,
+    interning each of them into the atom table. Returns the bitset of
+    the facts, built once from their ids.
+    """
+    ids = []
+    for token, fact_line, fact_column in tokens:
+        if token == ")":
+            return ids_to_mask(ids)
+        if token != "(":
+            raise SyntaxError("Unexpected '{}' in the initial state at line {}, column {}.".format(
+                token, fact_line, fact_column))
+        key = read_words(tokens, "Initial state facts must be atoms")
+        location = "line {}, column {}".format(fact_line, fact_column)
+        if len(key) < 2:
+            raise ValueError("Incorrect formatting for PDDL-style predicate string at {}.".format(location))
+        pred = predicates.get(key[0])
+        if pred is None:
+            raise SyntaxError("Predicate not yet defined: {} at {}".format(key[0], location))
+        if len(key) - 1 != len(pred.variables):
+            raise SyntaxError("Incorrect number of arguments for the predicate with name {} at {}".format(
+                key[0], location))
+        for o in key[1:]:
+            if o[0] == "?":
+                raise SyntaxError("Initial state must be completely grounded at {}.".format(location))
+        ids.append(atoms.intern_key(tuple(key)))
+    raise SyntaxError("Unclosed '(' at line {}, column {}.".format(line, column))
+
+
+def next_token(tokens):
+    for token in tokens:
+        return token
+    raise SyntaxError("Unexpected end of PDDL file.")
+
+
+def read_words(tokens, nested_error="Unexpected '('"):
+    """
+    Returns the words up to the next closing parenthesis
+    """
+    words = []
+    for token, line, column in tokens:
+        if token == ")":
+            return words
+        if token == "(":
+            raise SyntaxError("{} at line {}, column {}.".format(nested_error, line, column))
+        words.append(token)
+    raise SyntaxError("Unexpected end of PDDL file.")
 
 
 def load_domain(domain_file):
@@ -95,6 +144,7 @@ def load_domain(domain_file):
 
     domain_name = ""
     predicates = []
+    predicates_by_name = {}
     actions = []
     types = TypeTree()
 
@@ -125,6 +175,7 @@ def load_domain(domain_file):
         elif text_split[0].lower() == ":predicates":
             for pred in child.children:
                 predicates.append(Predicate.from_str(pred.text))
+                predicates_by_name[predicates[-1].name] = predicates[-1]
         elif text_split[0].lower() == ":action":
             action_name = text_split[1]
             parameters = None
@@ -142,16 +193,16 @@ def load_domain(domain_file):
                         ptype = splits[1] if len(splits) == 2 else None
                         parameters.append((pname, ptype))
                 elif item.lower() == ":precondition":
-                    precondition = process_proposition_nodes(child.children[i], predicates)
+                    precondition = process_proposition_nodes(child.children[i], predicates_by_name)
                 elif item.lower() == ":effect":
-                    effect = process_proposition_nodes(child.children[i], predicates)
+                    effect = process_proposition_nodes(child.children[i], predicates_by_name)
                 else:
-                    raise SyntaxError(
-                        "Unrecognized keyword in action definition: {}".format(item))
+                    raise SyntaxError("Unrecognized keyword in action definition: {} at {}".format(
+                        item, child.location()))
             actions.append(
                 Action(action_name, parameters, precondition, effect))
         else:
-            raise SyntaxError("Unrecognized keyword: {}".format(text_split[0]))
+            raise SyntaxError("Unrecognized keyword: {} at {}".format(text_split[0], child.location()))
 
     return Domain(domain_name, types, predicates, actions)
 
@@ -165,43 +216,45 @@ def process_proposition_nodes(t, predicates):
     elif txt == "not":
         if len(t.children) != 1:
             raise SyntaxError(
-                "Incorrect number of arguments for NOT statement.")
+                "Incorrect number of arguments for NOT statement at {}.".format(t.location()))
         return NOT(process_proposition_nodes(t.children[0], predicates))
     else:
-        return grounded_pred_from_str(t.text, predicates)
+        return grounded_pred_from_str(t.text, predicates, t.location())
 
-def grounded_pred_from_str(s, predicates):
+def grounded_pred_from_str(s, predicates, location=None):
+    """
+    Parses a predicate string, looking up its definition in the dict
+    mapping predicate names to the domain predicates. The location of
+    the string in its file, if given, is added to the errors.
+    """
+    at = "" if location is None else " at " + location
     s = s.replace('\r', '').replace('\n', '')
     pred = list(filter(None, s.split()))
     if len(pred) < 2:
         raise ValueError(
-            "Incorrect formatting for PDDL-style predicate string.")
+            "Incorrect formatting for PDDL-style predicate string{}.".format(at))
 
     name = pred[0]
-    pred_match = None
-    for p in predicates:
-        if p.name == name:
-            pred_match = p
-            break
+    pred_match = predicates.get(name)
     if pred_match is None:
-        raise SyntaxError("Predicate not yet defined: {}".format(name))
+        raise SyntaxError("Predicate not yet defined: {}{}".format(name, at))
     
     if len(pred[1:]) != len(pred_match.variables):
-        raise SyntaxError("Incorrect number of arguments for the predicate with name {}".format(pred.name))
+        raise SyntaxError("Incorrect number of arguments for the predicate with name {}{}".format(name, at))
     var_names = []
     grounding = {}
     for i, p in enumerate(pred[1:]):
         if p[0] == "?":
             if len(p) < 2:
                 raise ValueError(
-                    "Incorrect formatting for PDDL-style predicate string.")
+                    "Incorrect formatting for PDDL-style predicate string{}.".format(at))
             if (p[1:], pred_match.types[i]) in var_names:
-                raise ValueError("Duplicate variable name found: {}".format(p[1:]))
+                raise ValueError("Duplicate variable name found: {}{}".format(p[1:], at))
             var_names.append((p[1:], pred_match.types[i]))
         else:
             vn = "x{}".format(i)
             if (vn, pred_match.types[i]) in var_names:
-                raise ValueError("Duplicate variable name found: {}".format(vn))
+                raise ValueError("Duplicate variable name found: {}{}".format(vn, at))
             var_names.append((vn, pred_match.types[i]))
             grounding[vn] = p
     return Predicate(name, var_names, grounding)
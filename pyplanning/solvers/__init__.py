@@ -1,6 +1,14 @@
-from .search import search_plan
+from .search import search_plan, anytime_plan
 from .graphplan import graph_plan
 
 from . import search
 from . import heuristics
-from . import graphplan
\ No newline at end of file
+from . import landmarks
+from . import pdbs
+from . import search_space
+from . import successors
+from . import graphplan
+from . import parallel
+from . import portfolio
+from . import bounded
+from . import batch
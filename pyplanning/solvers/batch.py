@@ -0,0 +1,111 @@
+from ..strips import Domain
+from ..pddl import load_domain, load_problem
+from ..grounding import get_schemas
+from .graphplan import get_constant_predicates
+from .portfolio import solve_gbfs_ff
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import os
+import time
+
+
+def solve_batch(domain, problem_files, solve=solve_gbfs_ff, workers=None, max_pending=None):
+    """
+    Solves many problems of one domain in a process pool. The domain is
+    given as a Domain or a file name; it is parsed and analyzed once and
+    sent to every worker. Problem files may be any iterable, including a
+    generator, and at most max_pending of them (twice the number of
+    workers by default) are queued at a time. Yields a BatchResult for
+    each problem as it finishes, so results come out of order. Problems
+    that fail, including those left when a worker dies, are reported with
+    an error.
+
+    The solve function is called with each problem and returns a plan or
+    None. It must be picklable unless processes are forked.
+    """
+    if not isinstance(domain, Domain):
+        domain = load_domain(domain)
+    get_schemas(domain)
+    get_constant_predicates(domain)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(domain, solve)) as executor:
+        pending = dict()  # future -> problem file
+        for problem_file in problem_files:
+            try:
+                pending[executor.submit(solve_problem, problem_file)] = problem_file
+            except BrokenProcessPool as e:
+                yield BatchResult(problem_file, None, 0, 0, describe_error(e))
+                continue
+            if len(pending) >= max_pending:
+                yield from collect(pending)
+        while len(pending) > 0:
+            yield from collect(pending)
+
+
+def collect(pending):
+    """
+    Waits for some of the pending futures and yields their results. A
+    problem whose worker died, which breaks the whole pool, is reported
+    with an error like any other failure.
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        problem_file = pending.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            result = BatchResult(problem_file, None, 0, 0, describe_error(e))
+        yield result
+
+
+class BatchResult:
+    def __init__(self, problem_file, plan, load_time, solve_time, error=None):
+        self.problem_file = problem_file
+        self.plan = plan
+        self.load_time = load_time
+        self.solve_time = solve_time
+        self.error = error
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            outcome = "error: " + self.error
+        elif self.plan is None:
+            outcome = "no plan"
+        else:
+            outcome = "plan found"
+        return "BatchResult({}, load {:.3f}s, solve {:.3f}s, {})".format(
+            self.problem_file, self.load_time, self.solve_time, outcome)
+
+
+# Domain and solve function of a batch worker process, set by init_worker
+worker_state = dict()
+
+
+def init_worker(domain, solve):
+    worker_state["domain"] = domain
+    worker_state["solve"] = solve
+
+
+def solve_problem(problem_file):
+    start = time.time()
+    try:
+        problem = load_problem(worker_state["domain"], problem_file)
+    except Exception as e:
+        return BatchResult(problem_file, None, time.time() - start, 0, describe_error(e))
+    load_time = time.time() - start
+
+    start = time.time()
+    try:
+        plan = worker_state["solve"](problem)
+    except Exception as e:
+        return BatchResult(problem_file, None, load_time, time.time() - start, describe_error(e))
+    return BatchResult(problem_file, plan, load_time, time.time() - start)
+
+
+def describe_error(e):
+    return "{}: {}".format(type(e).__name__, e)
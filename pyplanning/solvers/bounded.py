@@ -0,0 +1,299 @@
+from ..strips import Problem
+from ..grounding import GroundedTask, get_task
+from .heuristics import null_heuristic
+from .successors import get_successor_generator
+from collections import OrderedDict
+import heapq
+
+
+def ida_star(problem: Problem, heuristic=null_heuristic, table_size=100000):
+    """
+    Iterative deepening A*. Each iteration is a depth-first search that
+    cuts off nodes with f above the threshold, the next threshold being
+    the smallest f that was cut off. A transposition table of at most
+    table_size states keeps the heuristic value of each state and the
+    lowest g it was reached with in the current iteration, so a state
+    reached again without a cheaper path is not searched twice.
+    """
+    if table_size < 1:
+        raise ValueError("Transposition table size must be at least 1.")
+    task = get_task(problem)
+    successors = get_successor_generator(task)
+    table = OrderedDict()  # bits -> [h, g, iteration]
+    threshold = heuristic(task.initial_state())
+    iteration = 0
+    while threshold < float('inf'):
+        path, threshold = bounded_dfs(task, successors, heuristic, table, table_size,
+                                      threshold, iteration)
+        if path is not None:
+            return [task.operators[op].ground() for op in path]
+        iteration += 1
+    return None
+
+
+def bounded_dfs(task: GroundedTask, successors, heuristic, table, table_size, threshold, iteration):
+    """
+    Returns the operator ids of a plan with cost at most threshold and
+    the threshold, or None and the smallest f above the threshold
+    """
+    if task.is_goal(task.init):
+        return [], threshold
+    next_threshold = float('inf')
+    path_bits = [task.init]
+    path_ops = []
+    on_path = {task.init}
+    stack = [iter(successors.applicable(task.init))]
+    while len(stack) > 0:
+        op = next(stack[-1], None)
+        if op is None:
+            stack.pop()
+            on_path.discard(path_bits.pop())
+            if len(path_ops) > 0:
+                path_ops.pop()
+            continue
+
+        bits = op.apply(path_bits[-1])
+        g = len(path_ops) + 1
+        if bits in on_path:
+            continue
+        entry = table.get(bits)
+        if entry is None:
+            entry = [heuristic(task.state(bits)), g, iteration]
+            table[bits] = entry
+            if len(table) > table_size:
+                table.popitem(last=False)
+        elif entry[2] == iteration and entry[1] <= g:
+            continue
+        else:
+            entry[1] = g
+            entry[2] = iteration
+            table.move_to_end(bits)
+
+        f = g + entry[0]
+        if f > threshold:
+            next_threshold = min(next_threshold, f)
+            continue
+        if task.is_goal(bits):
+            return path_ops + [op.index], threshold
+        path_bits.append(bits)
+        path_ops.append(op.index)
+        on_path.add(bits)
+        stack.append(iter(successors.applicable(bits)))
+    return None, next_threshold
+
+
+def sma_star(problem: Problem, heuristic=null_heuristic, max_nodes=100000):
+    """
+    Simplified memory-bounded A*. Each expansion generates a single
+    successor, the one with the lowest known f, so no node ever needs more
+    children than memory holds. Once more than max_nodes nodes are stored,
+    the leaf with the highest f (the shallowest on ties) is forgotten and
+    its f is kept on the parent, which generates it again once it is the
+    most promising. Plans are optimal for an admissible heuristic as long
+    as the optimal plan fits in memory.
+    """
+    if max_nodes < 2:
+        raise ValueError("Memory bound must be at least 2 nodes.")
+    return SMASearch(get_task(problem), heuristic, max_nodes).search()
+
+
+class SMANode:
+    __slots__ = ["bits", "parent", "op", "g", "f", "children", "ops", "next", "forgotten"]
+
+    def __init__(self, bits, parent, op, g, f):
+        self.bits = bits
+        self.parent = parent
+        self.op = op
+        self.g = g
+        self.f = f
+        self.children = dict()  # op id -> child node
+        self.ops = None  # Applicable operators, listed on the first expansion
+        self.next = 0  # Index in ops of the first successor never generated
+        self.forgotten = dict()  # op id -> f of a forgotten child
+
+    def generated_all(self):
+        return self.ops is not None and self.next == len(self.ops)
+
+    def priority(self):
+        """
+        Returns the lowest f of the successors still to be generated
+        """
+        p = float('inf') if self.generated_all() else self.f
+        if len(self.forgotten) > 0:
+            p = min(p, min(self.forgotten.values()))
+        return p
+
+
+class SMASearch:
+    def __init__(self, task: GroundedTask, heuristic, max_nodes):
+        self.task = task
+        self.heuristic = heuristic
+        self.max_nodes = max_nodes
+        self.successors = get_successor_generator(task)
+        self.index = dict()  # bits -> stored node with the lowest g
+        self.num_nodes = 0
+        self.fringe = []  # (priority, -g, count, node)
+        self.leaves = []  # (-f, g, count, node)
+        self.count = 0
+
+    def search(self):
+        root = SMANode(self.task.init, None, -1, 0, self.heuristic(self.task.initial_state()))
+        self.add_node(root)
+        while len(self.fringe) > 0:
+            p, _, _, node = heapq.heappop(self.fringe)
+            if not self.is_open(node) or p != node.priority():
+                continue
+            if p == float('inf'):
+                return None
+            if self.task.is_goal(node.bits):
+                return self.extract_plan(node)
+            child = self.expand(node)
+            while self.num_nodes > self.max_nodes:
+                self.forget_leaf(child)
+            if len(self.fringe) + len(self.leaves) > 4 * self.max_nodes:
+                self.compact()
+        return None
+
+    def is_open(self, node):
+        return node.bits is not None and (not node.generated_all() or len(node.forgotten) > 0)
+
+    def push(self, node):
+        self.count += 1
+        heapq.heappush(self.fringe, (node.priority(), -node.g, self.count, node))
+
+    def add_node(self, node):
+        self.num_nodes += 1
+        self.index[node.bits] = node
+        self.push(node)
+        self.push_leaf(node)
+
+    def push_leaf(self, node):
+        self.count += 1
+        heapq.heappush(self.leaves, (-node.f, node.g, self.count, node))
+
+    def is_leaf(self, node):
+        return node.bits is not None and len(node.children) == 0 and node.parent is not None
+
+    def expand(self, node):
+        """
+        Generates the successor of the node with the lowest known f that
+        is not in memory and returns it, or None if there is none left
+        """
+        if node.ops is None:
+            node.ops = list(self.successors.applicable(node.bits))
+        child = None
+        while child is None:
+            if not node.generated_all() and (len(node.forgotten) == 0 or
+                                             node.f <= min(node.forgotten.values())):
+                op = node.ops[node.next]
+                node.next += 1
+                f = node.f
+            elif len(node.forgotten) > 0:
+                op_id = min(node.forgotten, key=node.forgotten.get)
+                op = self.task.operators[op_id]
+                f = node.forgotten.pop(op_id)
+            else:
+                break
+            child = self.generate(node, op, f)
+
+        if node.generated_all():
+            self.backup(node)
+        if self.is_open(node):
+            self.push(node)
+        if len(node.children) == 0:
+            self.push_leaf(node)
+        return child
+
+    def generate(self, node, op, f):
+        """
+        Stores the successor of the node reached with op, with f at least
+        the given lower bound, unless its state is stored with a lower g
+        """
+        bits = op.apply(node.bits)
+        g = node.g + 1
+        known = self.index.get(bits)
+        if known is not None and known.g <= g:
+            return None
+        if g >= self.max_nodes - 1 and not self.task.is_goal(bits):
+            # The path cannot be extended within the memory bound
+            f = float('inf')
+        else:
+            f = max(f, node.f, g + self.heuristic(self.task.state(bits)))
+        child = SMANode(bits, node, op.index, g, f)
+        node.children[op.index] = child
+        self.add_node(child)
+        return child
+
+    def backup(self, node):
+        """
+        Updates the f of the node and of its ancestors to the lowest f of
+        their children, stored or forgotten, once all of them were generated
+        """
+        while node is not None and node.generated_all():
+            f = min(node.forgotten.values(), default=float('inf'))
+            for child in node.children.values():
+                f = min(f, child.f)
+            if f == node.f:
+                break
+            node.f = f
+            node = node.parent
+
+    def forget_leaf(self, keep):
+        """
+        Forgets the leaf with the highest f other than keep, the node just
+        generated
+        """
+        skipped = []
+        while True:
+            entry = heapq.heappop(self.leaves)
+            f, _, _, node = entry
+            if node is keep:
+                skipped.append(entry)
+            elif self.is_leaf(node) and -f == node.f:
+                break
+        for entry in skipped:
+            heapq.heappush(self.leaves, entry)
+
+        parent = node.parent
+        del parent.children[node.op]
+        if self.index.get(node.bits) is node:
+            del self.index[node.bits]
+        node.bits = None
+        self.num_nodes -= 1
+
+        if node.f < float('inf'):
+            # Children that cannot lead to a plan are not generated again
+            parent.forgotten[node.op] = node.f
+        self.backup(parent)
+        if self.is_open(parent):
+            self.push(parent)
+        if len(parent.children) == 0:
+            self.push_leaf(parent)
+
+    def compact(self):
+        """
+        Drops the outdated entries of both heaps, which would otherwise
+        grow without bound as nodes are forgotten and generated again
+        """
+        self.fringe = unique_entries(self.fringe, lambda p, node: self.is_open(node) and p == node.priority())
+        self.leaves = unique_entries(self.leaves, lambda f, node: self.is_leaf(node) and -f == node.f)
+
+    def extract_plan(self, node):
+        path = []
+        while node.parent is not None:
+            path.append(self.task.operators[node.op].ground())
+            node = node.parent
+        path.reverse()
+        return path
+
+
+def unique_entries(heap, valid):
+    entries = []
+    seen = set()
+    for entry in heap:
+        node = entry[-1]
+        if valid(entry[0], node) and id(node) not in seen:
+            seen.add(id(node))
+            entries.append(entry)
+    heapq.heapify(entries)
+    return entries
@@ -1,9 +1,9 @@
 import itertools
 from ..strips import KnowledgeState, Problem
+from ..grounding import get_task, ids_to_mask, mask_to_ids
 from ..action import NopAction
-from ..logic import AND, NOT, Predicate
-from ..utils import PriorityQueue
-import copy
+from ..logic import NOT, Predicate
+from bisect import bisect_right
 import time
 
 
@@ -50,15 +50,16 @@ def remove_plan_nops(plan):
 
 def make_grounded_actions(problem, constant_predicates):
     """
-    Make a set of actions grounded in every possible set of literals
+    Make a set of actions grounded in every reachable set of literals
     and NopActions for every possible predicate
     """
     grounded = []
-    for a_name, a in problem.domain.actions.items():
-        for objs in itertools.product(*[problem.get_typed_objs(t) for t in a.types]):
-            if len(set(objs)) != len(objs):
-                continue
-            grounded.append(a.ground(objs))
+    seen = set()
+    for op in get_task(problem).operators:
+        if (op.name, op.objects) in seen:
+            continue
+        seen.add((op.name, op.objects))
+        grounded.append(op.ground())
 
     for p_name, p in problem.domain.predicates.items():
         if p in constant_predicates:
@@ -87,11 +88,25 @@ def make_grounded_preds(problem, initial):
 
 
 def find_constant_predicates(problem: Problem):
-    constant_predicates = set(problem.domain.predicates.values())
-    for p in problem.domain.predicates.values():
+    return get_constant_predicates(problem.domain)
+
+
+def get_constant_predicates(domain):
+    """
+    Returns the predicates that no action changes, computing them on first
+    use so that they are shared by all problems of the domain
+    """
+    if domain.constant_predicates is None:
+        domain.constant_predicates = compute_constant_predicates(domain)
+    return domain.constant_predicates
+
+
+def compute_constant_predicates(domain):
+    constant_predicates = set(domain.predicates.values())
+    for p in domain.predicates.values():
         constant_predicates.add(NOT(p))
 
-    for a in problem.domain.actions.values():
+    for a in domain.actions.values():
         for prop in a.effect.props:
             constant_predicates.discard(prop)
             if isinstance(prop, NOT):
@@ -113,235 +128,345 @@ def find_constant_knowledge(knowledge: KnowledgeState, constant_predicates):
     return constant_knowledge
 
 
-class Level:
-    def __init__(self, prev_layer, actions):
-        self.prev_layer = prev_layer
-        self.actions = frozenset(actions)
-        all_effects = get_all_effects(actions)
-        self.state = KnowledgeState(all_effects, True)
-
-        self.action_mutex = set()
-        self.get_action_mutex()
-        self.literal_mutex = set()
-        self.get_literal_mutex()
-
-    def get_action_mutex(self):
-        for actions in itertools.combinations(self.actions, 2):
-            for e in actions[0].effects:
-                # Inconsisent effects
-                if (isinstance(e, NOT) and e.prop in actions[1].effects) or (NOT(e) in actions[1].effects):
-                    self.action_mutex.add(frozenset(actions))
-                # Interference (a1 effects -> a2 precondition)
-                elif (isinstance(e, NOT) and e.prop in actions[1].precondition) or (NOT(e) in actions[1].precondition):
-                    self.action_mutex.add(frozenset(actions))
-            for p in actions[0].precondition:
-                # Interference (a1 precondition -> a2 effects)
-                if (isinstance(p, NOT) and p.prop in actions[1].effects) or (NOT(p) in actions[1].effects):
-                    self.action_mutex.add(frozenset(actions))
-                # Competing needs
-                for p2 in actions[1].precondition:
-                    if frozenset([p, p2]) in self.prev_layer.literal_mutex:
-                        self.action_mutex.add(frozenset(actions))
-                        break
-
-    def get_literal_mutex(self):
-        producing_actions = {}
-        # Direct mutex (e.g. literal and ~literal)
-        for literal in self.state.knowledge:
-            if isinstance(literal, NOT) and literal.prop in self.state.knowledge:
-                self.literal_mutex.add(frozenset([literal.prop, literal]))
-            elif NOT(literal) in self.state.knowledge:
-                self.literal_mutex.add(frozenset([literal, NOT(literal)]))
-            # Cache producing actions for use below
-            producing_actions[literal] = self.get_producing_actions(literal)
-        
-        # Inconsistent support
-        for literals in itertools.combinations(self.state.knowledge, 2):
-            l1_a = producing_actions[literals[0]]
-            l2_a = producing_actions[literals[1]]
-            found = False
-            for action_pair in itertools.product(l1_a, l2_a):
-                if frozenset(action_pair) not in self.action_mutex:
-                    found = True  # non-mutex action pair means literals can be produced
-                    break
-            if not found:
-                self.literal_mutex.add(frozenset(literals))
-
-    def get_producing_actions(self, literal):
-        producing = []
-        for a in self.actions:
-            if literal in a.effects:
-                producing.append(a)
-        return producing
-
-
-class InitialLevel(Level):
-    def __init__(self, state):
-        self.prev_layer = None
-        self.actions = frozenset()
-        self.state = state
-        self.action_mutex = set()
-        self.literal_mutex = set()
-
-
 class PlanningGraph:
+    """
+    Bi-level planning graph. Instead of storing every level, the graph
+    records the first level at which each action and literal appears and,
+    for each mutex pair that disappeared, the last level at which it held.
+    Mutex rows of the current level are kept to expand the next one.
+    """
+
     def __init__(self, problem: Problem):
         self.problem = problem
         self.goals = frozenset(self.problem.goal_state.props)
         self.init_state = KnowledgeState(make_grounded_preds(
             problem, problem.initial_state.knowledge), explicit_delete=True)
-        self.levels = [InitialLevel(self.init_state)]
         self.constant_predicates = find_constant_predicates(problem)
         self.constant_knowledge = find_constant_knowledge(self.init_state, self.constant_predicates)
         self.grounded_actions = make_grounded_actions(problem, self.constant_predicates)
-        self.no_goods = set()
+        self.literal_level = []
+        self.index_actions()
+
+        self.depth = 0
+        self.action_level = [-1] * len(self.actions)
+        self.action_bits = 0
+        self.literal_bits = 0
+        for l in self.init_state.knowledge:
+            self.literal_bits |= 1 << self.literal_id(l)
+        for l in mask_to_ids(self.literal_bits):
+            self.literal_level[l] = 0
+        self.action_mutex = dict()
+        self.literal_mutex = dict()
+        self.action_mutex_end = dict()
+        self.literal_mutex_end = dict()
+        self.changes = 0
+
+        self.unsatisfied = [len(pre) for pre in self.pre_ids]
+        self.enabled_actions = ids_to_mask([a for a, n in enumerate(self.unsatisfied) if n == 0])
+        self.seen_literals = 0
+        self.constant_ids = frozenset(self.literal_id(l) for l in self.constant_knowledge)
+        self.is_nop = [isinstance(a, NopAction) for a in self.actions]
+        self.producer_index = dict()
+        self.no_goods = dict()
+        self.num_no_goods = 0
         self.no_goods_history = []
 
-    def get_current_state(self):
-        full_knowledge = self.levels[-1].state.knowledge.union(self.constant_knowledge)
-        return KnowledgeState(full_knowledge, True)
+    def literal_id(self, literal):
+        idx = self.literal_ids.get(literal)
+        if idx is None:
+            idx = len(self.literals)
+            self.literal_ids[literal] = idx
+            self.literals.append(literal)
+            self.complement_ids.append(-1)
+            self.producers.append(0)
+            self.consumers.append(0)
+            self.literal_level.append(-1)
+            c = self.literal_id(literal.prop if isinstance(literal, NOT) else NOT(literal))
+            self.complement_ids[idx] = c
+            self.complement_ids[c] = idx
+        return idx
+
+    def index_actions(self):
+        """
+        Assign integer ids to all grounded actions and literals, and
+        precompute the precondition/effect incidence of every action
+        together with the level-independent interference mutexes
+        """
+        self.literal_ids = dict()
+        self.literals = []
+        self.complement_ids = []
+        self.producers = []
+        self.consumers = []
+        self.actions = list(self.grounded_actions)
+        self.action_ids = {a: i for i, a in enumerate(self.actions)}
+        self.pre_ids = []
+        self.eff_ids = []
+        self.eff_bits = []
+        for i, a in enumerate(self.actions):
+            pre = list(set([self.literal_id(p) for p in a.precondition]))
+            eff = list(set([self.literal_id(e) for e in a.effects]))
+            self.pre_ids.append(pre)
+            self.eff_ids.append(eff)
+            self.eff_bits.append(ids_to_mask(eff))
+            for p in pre:
+                self.consumers[p] |= 1 << i
+            for e in eff:
+                self.producers[e] |= 1 << i
+
+        # Inconsistent effects and interference
+        self.interference = []
+        for i in range(len(self.actions)):
+            row = 0
+            for e in self.eff_ids[i]:
+                c = self.complement_ids[e]
+                row |= self.producers[c] | self.consumers[c]
+            for p in self.pre_ids[i]:
+                row |= self.producers[self.complement_ids[p]]
+            self.interference.append(row)
 
     def expand_graph(self):
-        curr_state = self.get_current_state()
-        valid_actions = []
-        for ga in self.grounded_actions:
-            if ga.action.check_preconditions(curr_state, ga.objects):
-                valid_actions.append(ga)
-        level = Level(self.levels[-1], valid_actions)
-        self.levels.append(level)
-
-    def check_goal(self):
-        base_check = self.problem.check_goal(self.get_current_state())
-        if base_check:
-            for a_pair in itertools.combinations(self.problem.goal_state.props, 2):
-                if frozenset(a_pair) in self.levels[-1].literal_mutex:
-                    return False
+        # Only actions whose last missing precondition appeared are new
+        new_literals = self.literal_bits & ~self.seen_literals
+        self.seen_literals |= new_literals
+        for l in mask_to_ids(new_literals):
+            for a in mask_to_ids(self.consumers[l]):
+                self.unsatisfied[a] -= 1
+                if self.unsatisfied[a] == 0:
+                    self.enabled_actions |= 1 << a
+
+        self.depth += 1
+        prev_actions = self.action_bits
+        prev_literals = self.literal_bits
+        self.action_bits = self.enabled_actions
+        self.literal_bits = 0
+        for a in mask_to_ids(self.action_bits):
+            self.literal_bits |= self.eff_bits[a]
+        new_actions = self.action_bits & ~prev_actions
+        new_literals = self.literal_bits & ~prev_literals
+        for a in mask_to_ids(new_actions):
+            self.action_level[a] = self.depth
+        for l in mask_to_ids(new_literals):
+            if self.literal_level[l] == -1:
+                self.literal_level[l] = self.depth
+
+        removed = self.update_action_mutex(new_actions)
+        removed += self.update_literal_mutex(prev_literals, new_literals)
+        self.changes = len(mask_to_ids(new_actions)) + len(mask_to_ids(new_literals)) + removed
+
+    def update_action_mutex(self, new_actions):
+        """
+        Computes the action mutex rows of the new level from the rows of
+        the previous level. Only pairs that were mutex before or involve
+        a new action are examined. Returns the number of removed pairs.
+        """
+        # Competing needs: actions consuming a literal mutex with the precondition
+        competing = dict()
+        for p, row in self.literal_mutex.items():
+            needs = 0
+            for q in mask_to_ids(row):
+                needs |= self.consumers[q]
+            competing[p] = needs
+
+        action_mutex = dict()
+        removed = 0
+        for a in mask_to_ids(self.action_bits):
+            prev_row = self.action_mutex.get(a, 0)
+            if (new_actions >> a) & 1:
+                candidates = self.action_bits
+            else:
+                candidates = prev_row | new_actions
+            candidates &= ~(1 << a)
+            row = self.interference[a] & candidates
+            if candidates & ~row:
+                for p in self.pre_ids[a]:
+                    row |= competing.get(p, 0) & candidates
+            if row:
+                action_mutex[a] = row
+            for b in mask_to_ids(prev_row & ~row):
+                if a < b:
+                    self.action_mutex_end[(a, b)] = self.depth - 1
+                    removed += 1
+        self.action_mutex = action_mutex
+        return removed
+
+    def update_literal_mutex(self, prev_literals, new_literals):
+        """
+        Computes the literal mutex rows of the new level from the rows of
+        the previous level. Returns the number of removed pairs.
+        """
+        literal_mutex = dict()
+        removed = 0
+        for l in mask_to_ids(self.literal_bits):
+            prev_row = self.literal_mutex.get(l, 0)
+            if (new_literals >> l) & 1:
+                candidates = self.literal_bits
+            else:
+                candidates = prev_row | new_literals
+            candidates &= ~(1 << l)
+            row = 0
+            if candidates:
+                # Literals supported by an action that is not mutex with
+                # some producer of l are not mutex with l (inconsistent support)
+                non_mutex = 0
+                for a in mask_to_ids(self.producers[l] & self.action_bits):
+                    non_mutex |= self.action_bits & ~self.action_mutex.get(a, 0)
+                supported = 0
+                for b in mask_to_ids(non_mutex):
+                    supported |= self.eff_bits[b]
+                row = candidates & ~supported
+                # Direct mutex (e.g. literal and ~literal)
+                c = self.complement_ids[l]
+                if (candidates >> c) & 1:
+                    row |= 1 << c
+            if row:
+                literal_mutex[l] = row
+            for m in mask_to_ids(prev_row & ~row):
+                if l < m:
+                    self.literal_mutex_end[(l, m)] = self.depth - 1
+                    removed += 1
+        self.literal_mutex = literal_mutex
+        return removed
+
+    def is_action_mutex(self, a, b, level):
+        """
+        Determines whether two action ids are mutex at the given level
+        """
+        if (self.action_mutex.get(a, 0) >> b) & 1:
+            return True  # Mutex now, so mutex at every level where both exist
+        end = self.action_mutex_end.get((min(a, b), max(a, b)))
+        return end is not None and level <= end
+
+    def is_literal_mutex(self, l1, l2, level):
+        """
+        Determines whether two literal ids are mutex at the given level
+        """
+        if level == 0:
+            return False
+        if (self.literal_mutex.get(l1, 0) >> l2) & 1:
             return True
-        return False
+        end = self.literal_mutex_end.get((min(l1, l2), max(l1, l2)))
+        return end is not None and level <= end
 
-    def check_graph_levelOff(self):
-        if len(self.levels) < 2:
-            return False
+    def has_literal(self, literal, level):
+        lvl = self.literal_level[self.literal_id(literal)]
+        return lvl != -1 and lvl <= level
 
-        curr_level = self.levels[-1]
-        prev_level = self.levels[-2]
-        
-        actions_bool = (curr_level.actions == prev_level.actions)
-        state_bool = (curr_level.state == prev_level.state)
-        action_mutex_bool = (curr_level.action_mutex == prev_level.action_mutex)
-        literal_mutex_bool = (curr_level.literal_mutex == prev_level.literal_mutex)
+    def check_goal(self):
+        for g in self.goals:
+            if not self.has_literal(g, self.depth):
+                return False
+        for a_pair in itertools.combinations(self.goals, 2):
+            if self.is_literal_mutex(self.literal_id(a_pair[0]), self.literal_id(a_pair[1]), self.depth):
+                return False
+        return True
 
-        if actions_bool and state_bool and action_mutex_bool and literal_mutex_bool:
-            return True
-        return False
+    def check_graph_levelOff(self):
+        return self.depth > 1 and self.changes == 0
 
     def check_noGood_levelOff(self):
         if len(self.no_goods_history) < 2:
             return False
-        return (self.no_goods == self.no_goods_history[-1])
-
-    def remove_constant_knowledge(self, k):
-        mutable = k.copy()
-        for pred in k:
-            if pred in self.constant_knowledge:
-                mutable.discard(pred)
-        return mutable
+        return (self.num_no_goods == self.no_goods_history[-1])
 
     def extract_solution(self):
-        last_level = len(self.levels) - 1
-        self.no_goods_history.append(self.no_goods.copy())
-        g = self.remove_constant_knowledge(self.goals)
+        last_level = self.depth
+        self.no_goods_history.append(self.num_no_goods)
+        g = frozenset(self.literal_id(l) for l in self.goals) - self.constant_ids
         return self.backward_search(last_level, g)
 
+    def add_no_good(self, level, goals):
+        self.no_goods.setdefault(level, NoGoodTrie()).add(goals)
+        self.num_no_goods += 1
+
+    def is_no_good(self, level, goals):
+        return level in self.no_goods and self.no_goods[level].contains_subset(goals)
+
     def backward_search(self, level, goals):
-        if (level, goals) in self.no_goods:
+        if self.is_no_good(level, goals):
             return False, None
         if level == 0:
-            if self.levels[level].state.query(AND(goals)):
+            if all(self.literal_level[g] == 0 for g in goals):
                 return True, {0: {}}
-            else:
-                self.no_goods.add((level, goals))
-                return False, None
-
-        # Use BFS to find a set of actions that achieves the goals
-        current_level = self.levels[level]
-        fringe = PriorityQueue()
-        visited = set()
-        for a in get_relevant_actions(current_level.actions, goals):
-            fringe.push(frozenset([a]))
-
-        while len(fringe) > 0:
-            action_set = fringe.pop()
-            if action_set in visited:
-                continue
-            visited.add(action_set)
-            all_effects = get_all_effects(action_set)
-
-            if goals.issubset(all_effects):
-                # Found a set of actions that achieves the goals,
-                # now check if the preconditions for those actions are reachable
-                precons = get_all_preconditions(action_set)
-                precons = self.remove_constant_knowledge(precons)
-                res, subplan = self.backward_search(
-                    level-1, frozenset(precons))
-                if res:
-                    plan = copy.deepcopy(subplan)
-                    plan[level] = action_set
-                    return True, plan
-            else:
-                # Expand the current action set with any relevant actions
-                # which are not in mutex with the current set
-                goals_remaining = goals.difference(all_effects)
-                for ra in get_relevant_actions(current_level.actions, goals_remaining):
-                    if not check_mutex(current_level, action_set, ra):
-                        new_set = frozenset(list(action_set) + [ra])
-                        if new_set not in visited:
-                            fringe.push(new_set)
-
-        # If the fringe is empty without returning,
-        # then we have a no good
-        self.no_goods.add((level, goals))
-        return False, None
-
-
-def check_mutex(level: Level, action_set, action):
-    """
-    Determines whether an action is mutex with any of the actions
-    in the given set of actions at the given level
-    """
-    for a in action_set:
-        if frozenset([action, a]) in level.action_mutex:
-            return True
-    return False
-
+            self.add_no_good(level, goals)
+            return False, None
 
-def get_all_effects(action_set):
-    """
-    Returns a set of all effects for the actions in the given set
-    """
-    all_effects = set()
-    for a in action_set:
-        all_effects.update(a.effects)
-    return all_effects
+        # Assign producers goal by goal, hardest (latest appearing) goals first
+        ordered = sorted(goals, key=lambda g: -self.literal_level[g])
+        res, plan = self.assign_goals(level, ordered, 0, [], 0)
+        if not res:
+            self.add_no_good(level, goals)
+        return res, plan
+
+    def assign_goals(self, level, goals, i, chosen, covered):
+        while i < len(goals) and (covered >> goals[i]) & 1:
+            i += 1
+        if i == len(goals):
+            # All goals are achieved by the chosen actions, now check
+            # if the preconditions for those actions are reachable
+            precons = set()
+            for a in chosen:
+                precons.update(self.pre_ids[a])
+            res, subplan = self.backward_search(level-1, frozenset(precons) - self.constant_ids)
+            if res:
+                subplan[level] = set(self.actions[a] for a in chosen)
+                return True, subplan
+            return False, None
 
+        for a in self.get_producers(level, goals[i]):
+            if any(self.is_action_mutex(a, b, level) for b in chosen):
+                continue
+            chosen.append(a)
+            res, plan = self.assign_goals(level, goals, i+1, chosen, covered | self.eff_bits[a])
+            chosen.pop()
+            if res:
+                return True, plan
+        return False, None
 
-def get_all_preconditions(action_set):
+    def get_producers(self, level, literal):
+        """
+        Returns the ids of the actions producing the literal at the given
+        level, NopActions first and then by the level of their preconditions.
+        Producers are indexed per literal sorted by action level, rebuilt
+        when the graph has grown, and sliced by the level of the query.
+        """
+        entry = self.producer_index.get(literal)
+        if entry is None or entry[0] != self.depth:
+            producers = [a for a in mask_to_ids(self.producers[literal]) if self.action_level[a] > 0]
+            producers.sort(key=lambda a: (self.action_level[a],
+                                          sum([self.literal_level[p] for p in self.pre_ids[a]])))
+            nops = [a for a in producers if self.is_nop[a]]
+            others = [a for a in producers if not self.is_nop[a]]
+            entry = (self.depth, nops, [self.action_level[a] for a in nops],
+                     others, [self.action_level[a] for a in others])
+            self.producer_index[literal] = entry
+        _, nops, nop_levels, others, other_levels = entry
+        return nops[:bisect_right(nop_levels, level)] + others[:bisect_right(other_levels, level)]
+
+
+class NoGoodTrie:
     """
-    Returns a set of all preconditions for the actions in the given set
+    Trie of no-good goal sets, stored as sorted literal ids, that
+    answers whether any stored set is a subset of a queried set
     """
-    all_precons = set()
-    for a in action_set:
-        all_precons.update(a.precondition)
-    return all_precons
-
 
-def get_relevant_actions(all_actions, goals):
-    """
-    Returns a subset of actions which have at least one of the goals
-    in their effects
-    """
-    relevant = []
-    for a in all_actions:
-        if len(a.effects.intersection(goals)) > 0:
-            relevant.append(a)
-    return relevant
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, goals):
+        node = self.root
+        for g in sorted(goals):
+            node = node.setdefault(g, dict())
+        node[None] = True
+
+    def contains_subset(self, goals):
+        goals = sorted(goals)
+        stack = [(self.root, 0)]
+        while len(stack) > 0:
+            node, i = stack.pop()
+            if None in node:
+                return True
+            for j in range(i, len(goals)):
+                child = node.get(goals[j])
+                if child is not None:
+                    stack.append((child, j + 1))
+        return False
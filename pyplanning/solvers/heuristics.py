@@ -1,4 +1,9 @@
 from pyplanning.logic import AND
+from ..grounding import get_task, ids_to_mask, mask_to_ids
+from ..strips import BitKnowledgeState
+from collections import OrderedDict
+import heapq
+import sys
 
 
 def null_heuristic(state):
@@ -26,4 +31,382 @@ def goals_remaining(problem):
 #     def h(state):
 #         plan = __asearch(problem, state, null_heuristic, "ignore")
 #         return plan_len(plan)
-#     return h
\ No newline at end of file
+#     return h
+
+def cached(heuristic, max_size=100000, max_bytes=None):
+    return CachedHeuristic(heuristic, max_size, max_bytes)
+
+def max_heuristic(problem):
+    return RelaxedHeuristic(problem, "max")
+
+def add_heuristic(problem):
+    return RelaxedHeuristic(problem, "add")
+
+def ff_heuristic(problem):
+    return RelaxedHeuristic(problem, "ff")
+
+def max_level(problem):
+    return PlanningGraphHeuristic(problem, "max")
+
+def level_sum(problem):
+    return PlanningGraphHeuristic(problem, "sum")
+
+def set_level(problem):
+    return PlanningGraphHeuristic(problem, "set")
+
+
+class RelaxedHeuristic:
+    """
+    Delete-relaxation heuristics over the compiled task of a problem.
+    Atom costs are propagated from the state with a priority queue and a
+    counter of unsatisfied preconditions per operator, so an evaluation is
+    linear in the size of the task (up to the queue overhead).
+    Mode "max" gives h_max, "add" gives h_add and "ff" gives the length of
+    a relaxed plan extracted from the h_add best supporters.
+    """
+
+    def __init__(self, problem, mode="ff"):
+        if mode not in ("max", "add", "ff"):
+            raise ValueError("Unknown relaxed heuristic: {}".format(mode))
+        self.mode = mode
+        self.task = get_task(problem)
+        self.num_atoms = len(self.task.atoms)
+        self.pre = [op.pre for op in self.task.operators]
+        self.add = [op.add for op in self.task.operators]
+        self.precondition_of = [[] for _ in range(self.num_atoms)]
+        for op in self.task.operators:
+            for p in op.pre:
+                self.precondition_of[p].append(op.index)
+        self.goals = [mask_to_ids(pos) for pos, _ in self.task.goals]
+        self.last_bits = None
+        self.last_preferred = set()
+
+    def __call__(self, state):
+        bits = self.task.encode(state)
+        costs, supporters = self.compute_costs(bits)
+        best = float('inf')
+        best_goal = None
+        for goal in self.goals:
+            if self.mode == "max":
+                value = max([costs[g] for g in goal], default=0)
+            else:
+                value = sum([costs[g] for g in goal])
+            if value < best:
+                best = value
+                best_goal = goal
+        self.last_bits = bits
+        self.last_preferred = set()
+        if self.mode != "ff" or best == float('inf'):
+            return best
+        plan = self.relaxed_plan(best_goal, costs, supporters)
+        for op in plan:
+            if all(costs[p] == 0 for p in self.pre[op]):
+                self.last_preferred.add(op)
+        return len(plan)
+
+    def preferred_operators(self, state):
+        """
+        Returns the ids of the operators of the relaxed plan that are
+        applicable in the state (only for mode "ff")
+        """
+        bits = self.task.encode(state)
+        if bits != self.last_bits:
+            self(bits)
+        return self.last_preferred
+
+    def compute_costs(self, bits):
+        inf = float('inf')
+        use_max = (self.mode == "max")
+        costs = [inf] * self.num_atoms
+        supporters = [-1] * self.num_atoms
+        unsatisfied = [len(p) for p in self.pre]
+        op_costs = [1] * len(self.pre)
+        heap = []
+        for a in mask_to_ids(bits):
+            if a < self.num_atoms:
+                costs[a] = 0
+                heap.append((0, a))
+        for op, pre in enumerate(self.pre):
+            if len(pre) == 0:
+                for e in self.add[op]:
+                    if 1 < costs[e]:
+                        costs[e] = 1
+                        supporters[e] = op
+                        heap.append((1, e))
+        heapq.heapify(heap)
+
+        while len(heap) > 0:
+            c, a = heapq.heappop(heap)
+            if c > costs[a]:
+                continue
+            for op in self.precondition_of[a]:
+                unsatisfied[op] -= 1
+                if use_max:
+                    op_costs[op] = max(op_costs[op], c + 1)
+                else:
+                    op_costs[op] += c
+                if unsatisfied[op] == 0:
+                    cost = op_costs[op]
+                    for e in self.add[op]:
+                        if cost < costs[e]:
+                            costs[e] = cost
+                            supporters[e] = op
+                            heapq.heappush(heap, (cost, e))
+        return costs, supporters
+
+    def relaxed_plan(self, goal, costs, supporters):
+        """
+        Returns the set of operator ids of a relaxed plan for the goal atoms
+        """
+        plan = set()
+        marked = set()
+        fringe = list(goal)
+        while len(fringe) > 0:
+            a = fringe.pop()
+            if a in marked or costs[a] == 0:
+                continue
+            marked.add(a)
+            op = supporters[a]
+            if op not in plan:
+                plan.add(op)
+                fringe += self.pre[op]
+        return plan
+
+
+class CachedHeuristic:
+    """
+    Wraps a heuristic with a cache of its values keyed on the state,
+    evicting the least recently used entries. The cache holds at most
+    max_size entries and, if max_bytes is given, at most max_bytes of
+    memory as estimated from the sizes of the keys and values plus a
+    fixed overhead per entry. Preferred operators of the wrapped
+    heuristic are cached along with the value.
+    """
+
+    # Estimated bytes of the dict slot and linked list node of an entry
+    entry_overhead = 100
+
+    def __init__(self, heuristic, max_size=100000, max_bytes=None):
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1.")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("Cache memory bound must be at least 1 byte.")
+        self.heuristic = heuristic
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()  # key -> (value, preferred, estimated bytes)
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if hasattr(heuristic, "preferred_operators"):
+            self.preferred_operators = self.cached_preferred_operators
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __call__(self, state):
+        return self.lookup(state)[0]
+
+    def lookup(self, state):
+        key = state.bits if isinstance(state, BitKnowledgeState) else state
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        value = self.heuristic(state)
+        preferred = None
+        if hasattr(self.heuristic, "preferred_operators"):
+            preferred = self.heuristic.preferred_operators(state)
+        size = (self.entry_overhead + sys.getsizeof(key) + sys.getsizeof(value)
+                + sys.getsizeof(preferred))
+        entry = (value, preferred, size)
+        self.cache[key] = entry
+        self.num_bytes += size
+        while len(self.cache) > self.max_size or (
+                self.max_bytes is not None and self.num_bytes > self.max_bytes and len(self.cache) > 1):
+            self.num_bytes -= self.cache.popitem(last=False)[1][2]
+        return entry
+
+    def cached_preferred_operators(self, state):
+        return self.lookup(state)[1]
+
+    def clear(self):
+        self.cache.clear()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class PlanningGraphHeuristic:
+    """
+    Heuristics read from a planning graph built from the state over the
+    compiled task. Mode "max" gives the max-level and "sum" the level-sum
+    of the goals in the relaxed planning graph. Mode "set" gives the
+    set-level, the first level of the planning graph with mutexes at
+    which all goals appear pairwise non-mutex. Incidence and interference
+    rows over operators and NOOPs are computed once and shared by every
+    evaluation.
+    """
+
+    def __init__(self, problem, mode="sum"):
+        if mode not in ("max", "sum", "set"):
+            raise ValueError("Unknown planning graph heuristic: {}".format(mode))
+        self.mode = mode
+        self.task = get_task(problem)
+        self.goal = self.task.goal_atoms()
+        self.goal_mask = self.task.goals[0][0]
+        self.num_atoms = len(self.task.atoms)
+        ops = self.task.operators
+        self.num_ops = len(ops)
+
+        # Actions are the operators followed by one NOOP per atom, action
+        # num_ops + p being the NOOP of atom p
+        self.pre_ids = [list(op.pre) for op in ops] + [[p] for p in range(self.num_atoms)]
+        self.pre_bits = [ids_to_mask(pre) for pre in self.pre_ids]
+        self.add_ids = [list(op.add) for op in ops]
+        self.add_bits = [op.add_mask for op in ops]
+        self.precondition_of = [[] for _ in range(self.num_atoms)]
+        self.producers = [1 << (self.num_ops + p) for p in range(self.num_atoms)]
+        self.consumers = [1 << (self.num_ops + p) for p in range(self.num_atoms)]
+        deleters = [0] * self.num_atoms
+        for op in ops:
+            for p in op.pre:
+                self.precondition_of[p].append(op.index)
+                self.consumers[p] |= 1 << op.index
+            for p in op.add:
+                self.producers[p] |= 1 << op.index
+            for p in op.delete:
+                deleters[p] |= 1 << op.index
+
+        # Inconsistent effects and interference, made symmetric
+        self.interference = []
+        for a in range(self.num_ops + self.num_atoms):
+            row = 0
+            if a < self.num_ops:
+                for d in ops[a].delete:
+                    row |= self.consumers[d] | self.producers[d]
+                effects = self.add_ids[a]
+            else:
+                effects = []
+            for p in self.pre_ids[a] + effects:
+                row |= deleters[p]
+            self.interference.append(row & ~(1 << a))
+
+    def __call__(self, state):
+        bits = self.task.encode(state)
+        if self.mode == "set":
+            return self.set_level(bits)
+        levels = self.relaxed_levels(bits)
+        if self.mode == "max":
+            return max([levels[g] for g in self.goal], default=0)
+        return sum([levels[g] for g in self.goal])
+
+    def relaxed_levels(self, bits):
+        """
+        Returns the first level of every atom in the relaxed planning graph
+        """
+        inf = float('inf')
+        levels = [inf] * self.num_atoms
+        unsatisfied = [len(p) for p in self.pre_ids[:self.num_ops]]
+        layer = [a for a in mask_to_ids(bits) if a < self.num_atoms]
+        for a in layer:
+            levels[a] = 0
+        next_layer = []
+        for op in range(self.num_ops):
+            if unsatisfied[op] == 0:
+                for e in self.add_ids[op]:
+                    if levels[e] == inf:
+                        levels[e] = 1
+                        next_layer.append(e)
+        depth = 0
+        while len(layer) + len(next_layer) > 0 and any(levels[g] == inf for g in self.goal):
+            for a in layer:
+                for op in self.precondition_of[a]:
+                    unsatisfied[op] -= 1
+                    if unsatisfied[op] == 0:
+                        for e in self.add_ids[op]:
+                            if levels[e] == inf:
+                                levels[e] = depth + 1
+                                next_layer.append(e)
+            depth += 1
+            layer = next_layer
+            next_layer = []
+        return levels
+
+    def set_level(self, bits):
+        num_ops = self.num_ops
+        op_mask = (1 << num_ops) - 1
+        unsatisfied = [len(p) for p in self.pre_ids[:num_ops]]
+        missing = len(self.goal)
+        # Mutexes only disappear from one level to the next, so enabled
+        # actions stay enabled and only the operators whose preconditions
+        # are present but mutex are tested again
+        candidates = [op for op in range(num_ops) if unsatisfied[op] == 0]
+        new_atoms = mask_to_ids(bits & ((1 << self.num_atoms) - 1))
+        atoms = 0
+        atom_mutex = dict()
+        actions = 0
+        next_atoms = 0
+        depth = 0
+        while True:
+            for p in new_atoms:
+                atoms |= 1 << p
+                next_atoms |= 1 << p
+                actions |= 1 << (num_ops + p)
+                if (self.goal_mask >> p) & 1:
+                    missing -= 1
+                for op in self.precondition_of[p]:
+                    unsatisfied[op] -= 1
+                    if unsatisfied[op] == 0:
+                        candidates.append(op)
+            if missing == 0 and \
+                    not any(atom_mutex.get(g, 0) & self.goal_mask for g in self.goal):
+                return depth
+
+            # Operators whose preconditions are present and pairwise non-mutex
+            blocked = []
+            for op in candidates:
+                pre_bits = self.pre_bits[op]
+                if any(atom_mutex.get(p, 0) & pre_bits for p in self.pre_ids[op]):
+                    blocked.append(op)
+                else:
+                    actions |= 1 << op
+                    next_atoms |= self.add_bits[op]
+            candidates = blocked
+
+            # Competing needs and interference
+            competing = dict()
+            for p, row in atom_mutex.items():
+                needs = 0
+                for q in mask_to_ids(row):
+                    needs |= self.consumers[q]
+                competing[p] = needs
+            action_mutex = dict()
+            for a in mask_to_ids(actions):
+                row = self.interference[a]
+                for p in self.pre_ids[a]:
+                    row |= competing.get(p, 0)
+                row &= actions
+                if row:
+                    action_mutex[a] = row
+
+            next_mutex = dict()
+            for l in mask_to_ids(next_atoms):
+                non_mutex = 0
+                for a in mask_to_ids(self.producers[l] & actions):
+                    non_mutex |= actions & ~action_mutex.get(a, 0)
+                # NOOPs support their own atom, operators their add effects
+                supported = non_mutex >> num_ops
+                for b in mask_to_ids(non_mutex & op_mask):
+                    supported |= self.add_bits[b]
+                row = next_atoms & ~supported
+                if row:
+                    next_mutex[l] = row
+
+            if next_atoms == atoms and next_mutex == atom_mutex:
+                return float('inf')  # Leveled off without reaching the goals
+            new_atoms = mask_to_ids(next_atoms & ~atoms)
+            atom_mutex = next_mutex
+            depth += 1
@@ -0,0 +1,231 @@
+from ..strips import Problem
+from ..grounding import get_task, ids_to_mask, mask_to_ids
+import heapq
+
+
+def landmark_count(problem):
+    return LandmarkCountHeuristic(problem)
+
+def lmcut(problem):
+    return LMCutHeuristic(problem)
+
+
+class LandmarkGraph:
+    """
+    Fact landmarks of a problem found by backchaining from the goals in
+    the relaxed planning graph. For every landmark that is not initially
+    true, the first achievers are the operators adding it that are
+    reachable without it; the preconditions shared by all of them are
+    landmarks greedy-necessarily ordered before it.
+    """
+
+    def __init__(self, problem: Problem):
+        self.task = get_task(problem)
+        task = self.task
+        goal = task.goal_atoms()
+        self.achievers = dict()
+        for op in task.operators:
+            for a in op.add:
+                self.achievers.setdefault(a, []).append(op)
+
+        self.landmarks = list(goal)
+        self.orderings = dict()  # landmark -> landmarks ordered before it
+        known = set(goal)
+        queue = [g for g in goal if not (task.init >> g) & 1]
+        while len(queue) > 0:
+            lm = queue.pop()
+            self.orderings.setdefault(lm, set())
+            reachable = self.relaxed_reachable(lm)
+            first_achievers = [op for op in self.achievers.get(lm, [])
+                               if all(p in reachable for p in op.pre)]
+            if len(first_achievers) == 0:
+                continue  # Unreachable landmark, the problem is unsolvable
+            shared = set(first_achievers[0].pre)
+            for op in first_achievers[1:]:
+                shared.intersection_update(op.pre)
+            for p in shared:
+                self.orderings[lm].add(p)
+                if p in known:
+                    continue
+                known.add(p)
+                self.landmarks.append(p)
+                if not (task.init >> p) & 1:
+                    queue.append(p)
+        self.goal_mask = ids_to_mask(goal)
+        self.mask = ids_to_mask(self.landmarks)
+
+    def relaxed_reachable(self, excluded):
+        """
+        Returns the atoms reachable in the delete relaxation without
+        using any operator that adds the excluded atom
+        """
+        reached = set(mask_to_ids(self.task.init))
+        changed = True
+        while changed:
+            changed = False
+            for op in self.task.operators:
+                if excluded in op.add:
+                    continue
+                if all(p in reached for p in op.pre):
+                    for a in op.add:
+                        if a not in reached:
+                            reached.add(a)
+                            changed = True
+        return reached
+
+
+class LandmarkCountHeuristic:
+    """
+    Counts the landmarks that still have to be achieved from a state.
+    A landmark counts as reached if it holds in the state or is ordered
+    before a landmark that does. Reached landmarks are needed again if
+    they are false and are a goal or ordered before an unreached landmark.
+    """
+
+    def __init__(self, problem: Problem):
+        self.graph = LandmarkGraph(problem)
+        self.task = self.graph.task
+        self.ancestors = dict()
+        self.successors = dict()
+        for lm in self.graph.landmarks:
+            self.successors[lm] = 0
+        for lm, before in self.graph.orderings.items():
+            for p in before:
+                self.successors[p] |= 1 << lm
+        for lm in self.graph.landmarks:
+            ancestors = 0
+            fringe = list(self.graph.orderings.get(lm, []))
+            while len(fringe) > 0:
+                p = fringe.pop()
+                if (ancestors >> p) & 1:
+                    continue
+                ancestors |= 1 << p
+                fringe += list(self.graph.orderings.get(p, []))
+            self.ancestors[lm] = ancestors
+
+    def __call__(self, state):
+        bits = self.task.encode(state)
+        true = bits & self.graph.mask
+        reached = true
+        for lm in mask_to_ids(true):
+            reached |= self.ancestors[lm]
+        unreached = self.graph.mask & ~reached
+
+        needed_again = reached & ~bits & self.graph.goal_mask
+        for lm in mask_to_ids(reached & ~bits & ~self.graph.goal_mask):
+            if self.successors[lm] & unreached:
+                needed_again |= 1 << lm
+        return popcount(unreached) + popcount(needed_again)
+
+
+class LMCutHeuristic:
+    """
+    Admissible landmark-cut heuristic. Repeatedly computes h_max with the
+    remaining operator costs, extracts a cut of operators between the
+    state and the goal zone of the justification graph and subtracts
+    the cheapest cost in the cut from all of its operators.
+    """
+
+    def __init__(self, problem: Problem):
+        self.task = get_task(problem)
+        num_atoms = len(self.task.atoms)
+        self.goal_atom = num_atoms
+        self.init_atom = num_atoms + 1
+        self.num_atoms = num_atoms + 2
+
+        # Artificial goal operator and init atom for precondition-free operators
+        self.pre = [list(op.pre) if len(op.pre) > 0 else [self.init_atom]
+                    for op in self.task.operators]
+        self.add = [list(op.add) for op in self.task.operators]
+        self.pre.append(self.task.goal_atoms())
+        self.add.append([self.goal_atom])
+        self.base_costs = [1] * len(self.task.operators) + [0]
+
+        self.precondition_of = [[] for _ in range(self.num_atoms)]
+        self.achievers = [[] for _ in range(self.num_atoms)]
+        for op in range(len(self.pre)):
+            for p in self.pre[op]:
+                self.precondition_of[p].append(op)
+            for a in self.add[op]:
+                self.achievers[a].append(op)
+
+    def __call__(self, state):
+        bits = self.task.encode(state)
+        state_atoms = [a for a in mask_to_ids(bits) if a < self.goal_atom] + [self.init_atom]
+        costs = list(self.base_costs)
+        h = 0
+        while True:
+            atom_costs, supporters = self.compute_hmax(state_atoms, costs)
+            if atom_costs[self.goal_atom] == float('inf'):
+                return float('inf')
+            if atom_costs[self.goal_atom] == 0:
+                return h
+
+            # Goal zone: atoms reaching the goal through zero-cost operators
+            goal_zone = {self.goal_atom}
+            fringe = [self.goal_atom]
+            while len(fringe) > 0:
+                a = fringe.pop()
+                for op in self.achievers[a]:
+                    s = supporters[op]
+                    if costs[op] == 0 and s is not None and s not in goal_zone:
+                        goal_zone.add(s)
+                        fringe.append(s)
+
+            # Before-goal zone and the cut between the two zones
+            supported = dict()
+            for op, s in enumerate(supporters):
+                if s is not None:
+                    supported.setdefault(s, []).append(op)
+            cut = set()
+            visited = set(state_atoms)
+            fringe = list(state_atoms)
+            while len(fringe) > 0:
+                a = fringe.pop()
+                for op in supported.get(a, []):
+                    for e in self.add[op]:
+                        if e in goal_zone:
+                            cut.add(op)
+                        elif e not in visited:
+                            visited.add(e)
+                            fringe.append(e)
+
+            m = min([costs[op] for op in cut])
+            h += m
+            for op in cut:
+                costs[op] -= m
+
+    def compute_hmax(self, state_atoms, costs):
+        """
+        Returns the h_max cost of every atom and the precondition of
+        every operator with maximal cost (None if not reachable)
+        """
+        inf = float('inf')
+        atom_costs = [inf] * self.num_atoms
+        supporters = [None] * len(self.pre)
+        unsatisfied = [len(p) for p in self.pre]
+        heap = []
+        for a in state_atoms:
+            atom_costs[a] = 0
+            heap.append((0, a))
+        heapq.heapify(heap)
+
+        while len(heap) > 0:
+            c, a = heapq.heappop(heap)
+            if c > atom_costs[a]:
+                continue
+            for op in self.precondition_of[a]:
+                unsatisfied[op] -= 1
+                if unsatisfied[op] == 0:
+                    # Atoms are popped in cost order, so the last one has maximal cost
+                    supporters[op] = a
+                    cost = c + costs[op]
+                    for e in self.add[op]:
+                        if cost < atom_costs[e]:
+                            atom_costs[e] = cost
+                            heapq.heappush(heap, (cost, e))
+        return atom_costs, supporters
+
+
+def popcount(mask):
+    return bin(mask).count("1")
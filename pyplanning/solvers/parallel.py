@@ -0,0 +1,291 @@
+from ..strips import Problem
+from ..grounding import GroundedTask, get_task
+from .heuristics import null_heuristic
+from .search_space import SearchSpace
+from .successors import get_successor_generator
+import heapq
+import multiprocessing
+import pickle
+import queue
+import traceback
+
+
+def hda_star(problem: Problem, heuristic=null_heuristic, workers=2, flush_size=32):
+    """
+    Hash-distributed A*. Each worker process owns the states that hash to
+    it and keeps its own open list and search space; successors owned by
+    another worker are sent to its inbox in batches of up to flush_size
+    nodes. Plans are optimal for an admissible heuristic.
+
+    The task and heuristic are passed to every worker, so the heuristic
+    must be picklable unless processes are forked.
+    """
+    task = get_task(problem)
+    # Built before the workers start so that they receive it with the task
+    get_successor_generator(task)
+    context = multiprocessing.get_context()
+    inboxes = [context.Queue() for _ in range(workers)]
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, daemon=True,
+                                 args=(task, heuristic, wid, inboxes, results, flush_size))
+                 for wid in range(workers)]
+    for p in processes:
+        p.start()
+    try:
+        inboxes[owner(task.init, workers)].put(("nodes", [(task.init, 0, -1, -1)]))
+        goal = wait_for_termination(inboxes, results, processes)
+        plan = None
+        if goal is not None:
+            plan = [task.operators[op].ground() for op in trace_plan(inboxes, results, processes, goal)]
+    except BaseException:
+        for p in processes:
+            p.terminate()
+        raise
+    finally:
+        for inbox in inboxes:
+            inbox.put(("stop",))
+        for p in processes:
+            p.join()
+    return plan
+
+
+def owner(bits, workers):
+    """
+    Returns the worker owning a state. The int hash is scrambled with
+    Fibonacci hashing so that the partition does not depend on low atoms only.
+    """
+    return (((hash(bits) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % workers
+
+
+def receive(results, processes, poll_interval=0.1):
+    """
+    Returns the next message of the workers. Raises the error of a worker
+    that failed, or a RuntimeError if a worker exited without reporting one.
+    """
+    while True:
+        try:
+            message = results.get(timeout=poll_interval)
+        except queue.Empty:
+            dead = [wid for wid, p in enumerate(processes) if p.exitcode is not None]
+            if len(dead) == 0:
+                continue
+            # A failed worker reports its error before it exits
+            try:
+                message = results.get(timeout=poll_interval)
+            except queue.Empty:
+                raise RuntimeError("HDA* worker {} exited with code {}.".format(
+                    dead[0], processes[dead[0]].exitcode))
+        if message[0] == "error":
+            _, wid, error, trace = message
+            error.__cause__ = RemoteTraceback(trace)
+            raise error
+        return message
+
+
+class RemoteTraceback(Exception):
+    """
+    Carries the formatted traceback of an error raised in a worker
+    """
+
+    def __init__(self, trace):
+        super().__init__(trace)
+        self.trace = trace
+
+    def __str__(self):
+        return "\n" + self.trace
+
+
+def wait_for_termination(inboxes, results, processes):
+    """
+    Collects goal reports and broadcasts the incumbent cost until every
+    worker is idle. Termination is detected with message counters: once
+    all workers reported idle and the total sent and received counts
+    match, every worker is probed and the search stops only if none of
+    them has sent or received anything since. Returns the (owner, node)
+    of the best goal found, or None.
+    """
+    workers = len(processes)
+    bound = float('inf')
+    goal = None
+    reports = [None] * workers  # Last (sent, received) reported while idle
+    snapshot = None  # Reports at the time of the current probe
+    answers = dict()
+    # The initial node counts as sent by the master
+    sent_by_master = 1
+    while True:
+        message = receive(results, processes)
+        kind = message[0]
+        if kind == "goal":
+            _, wid, node, g = message
+            if g < bound:
+                bound = g
+                goal = (wid, node)
+                for inbox in inboxes:
+                    inbox.put(("bound", bound))
+        elif kind == "idle":
+            _, wid, sent, received = message
+            reports[wid] = (sent, received)
+        elif kind == "busy":
+            reports[message[1]] = None
+        elif kind == "probe":
+            _, wid, idle, sent, received = message
+            answers[wid] = (sent, received) if idle else None
+            if len(answers) < workers:
+                continue
+            if all(answers[i] == snapshot[i] for i in range(workers)):
+                return goal
+            snapshot = None
+            answers = dict()
+
+        if snapshot is not None or any(r is None for r in reports):
+            continue
+        if sent_by_master + sum(r[0] for r in reports) == sum(r[1] for r in reports):
+            snapshot = list(reports)
+            for inbox in inboxes:
+                inbox.put(("probe",))
+
+
+def trace_plan(inboxes, results, processes, goal):
+    """
+    Follows the parent references of the goal node across the workers
+    and returns the operator ids from the initial state to the goal
+    """
+    workers = len(processes)
+    path = []
+    wid, node = goal
+    while True:
+        inboxes[wid].put(("trace", node))
+        _, parent, op = receive(results, processes)
+        if parent == -1:
+            break
+        path.append(op)
+        wid, node = parent % workers, parent // workers
+    path.reverse()
+    return path
+
+
+def run_worker(task: GroundedTask, heuristic, wid, inboxes, results, flush_size):
+    try:
+        HDAWorker(task, heuristic, wid, inboxes, results, flush_size).run()
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError("{}: {}".format(type(e).__name__, e))
+        results.put(("error", wid, e, traceback.format_exc()))
+
+
+class HDAWorker:
+    """
+    One partition of a hash-distributed A* search. Parents are stored as
+    node * workers + owner so that a single int refers to a node of any
+    worker. Nodes with f >= the incumbent cost are never expanded, and the
+    worker is idle once its open list holds no other node.
+    """
+
+    def __init__(self, task: GroundedTask, heuristic, wid, inboxes, results, flush_size):
+        self.task = task
+        self.heuristic = heuristic
+        self.wid = wid
+        self.workers = len(inboxes)
+        self.inboxes = inboxes
+        self.results = results
+        self.flush_size = flush_size
+        self.successors = get_successor_generator(task)
+        self.space = SearchSpace()
+        self.h_values = []
+        self.fringe = []
+        self.bound = float('inf')
+        self.outboxes = [[] for _ in range(self.workers)]
+        self.sent = 0
+        self.received = 0
+        self.idle = None  # Counts of the last idle report, None while busy
+
+    def run(self):
+        inbox = self.inboxes[self.wid]
+        while True:
+            has_work = self.has_work()
+            counts = (self.sent, self.received)
+            if has_work and self.idle is not None:
+                self.idle = None
+                self.results.put(("busy", self.wid))
+            elif not has_work and self.idle != counts:
+                # Received nodes may all be pruned, so the counts are
+                # reported again even if the worker stayed idle
+                self.idle = counts
+                self.results.put(("idle", self.wid) + counts)
+            try:
+                message = inbox.get(block=not has_work)
+            except queue.Empty:
+                self.expand_some()
+                continue
+            if not self.handle(message):
+                return
+
+    def has_work(self):
+        while len(self.fringe) > 0:
+            f, _, node = self.fringe[0]
+            if f < self.bound and not self.space.is_closed(node):
+                return True
+            heapq.heappop(self.fringe)
+        return False
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == "nodes":
+            self.received += 1
+            for bits, g, parent, op in message[1]:
+                self.insert(bits, g, parent, op)
+        elif kind == "bound":
+            self.bound = min(self.bound, message[1])
+        elif kind == "probe":
+            self.results.put(("probe", self.wid, not self.has_work(), self.sent, self.received))
+        elif kind == "trace":
+            node = message[1]
+            self.results.put(("trace", self.space.parents[node], self.space.operators[node]))
+        elif kind == "stop":
+            return False
+        return True
+
+    def insert(self, bits, g, parent, op):
+        node = self.space.lookup(bits)
+        if node is None:
+            node = self.space.register(bits, parent, op, g)
+            self.h_values.append(self.heuristic(self.task.state(bits)))
+        elif g < self.space.g[node]:
+            self.space.update(node, parent, op, g)
+            self.space.reopen(node)
+        else:
+            return
+        h = self.h_values[node]
+        if g + h < self.bound:
+            heapq.heappush(self.fringe, (g + h, h, node))
+
+    def expand_some(self):
+        for _ in range(self.flush_size):
+            if not self.has_work():
+                break
+            _, _, node = heapq.heappop(self.fringe)
+            self.space.close(node)
+            bits = self.space.states[node]
+            g = self.space.g[node]
+            if self.task.is_goal(bits):
+                self.bound = g
+                self.results.put(("goal", self.wid, node, g))
+                continue
+            parent = node * self.workers + self.wid
+            for op in self.successors.applicable(bits):
+                next_bits = op.apply(bits)
+                dest = owner(next_bits, self.workers)
+                if dest == self.wid:
+                    self.insert(next_bits, g + 1, parent, op.index)
+                else:
+                    self.outboxes[dest].append((next_bits, g + 1, parent, op.index))
+        self.flush()
+
+    def flush(self):
+        for dest, nodes in enumerate(self.outboxes):
+            if len(nodes) > 0:
+                self.inboxes[dest].put(("nodes", nodes))
+                self.sent += 1
+                self.outboxes[dest] = []
@@ -0,0 +1,211 @@
+from ..strips import Problem
+from ..grounding import GroundedTask, get_task
+from ..utils import atomic_write, evict
+from array import array
+import hashlib
+import json
+import os
+
+
+def pdb_heuristic(problem, patterns=None, pattern_size=4, cache_dir=None, max_size=1 << 30):
+    return CanonicalPDBHeuristic(problem, patterns, pattern_size, cache_dir, max_size)
+
+
+class PatternDatabase:
+    """
+    Goal distances of the projection of a task onto a pattern of atoms.
+    Abstract states are the integers formed by the pattern atoms, and
+    their distances are computed once by a backward breadth-first
+    exploration that regresses abstract states through the projected
+    operators. Unreachable abstract states are stored as -1.
+    """
+
+    def __init__(self, task: GroundedTask, pattern, distances=None):
+        self.task = task
+        self.pattern = list(pattern)
+        self.local = {a: i for i, a in enumerate(self.pattern)}
+        self.operators = self.project_operators()
+        self.goals = [(self.project(pos), self.project(neg)) for pos, neg in task.goals]
+        if distances is None:
+            distances = self.compute_distances()
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.distances)
+
+    def project(self, mask):
+        idx = 0
+        for a, i in self.local.items():
+            if (mask >> a) & 1:
+                idx |= 1 << i
+        return idx
+
+    def project_operators(self):
+        projected = set()
+        for op in self.task.operators:
+            add = self.project(op.add_mask)
+            delete = self.project(op.del_mask) & ~add
+            pre = self.project(op.pre_mask)
+            neg = self.project(op.neg_mask)
+            if (add == 0 and delete == 0) or (pre & neg):
+                continue
+            projected.add((pre, neg, add, delete))
+        return sorted(projected)
+
+    def affected(self):
+        """
+        Returns the ids of the task operators with an effect on the pattern
+        """
+        mask = 0
+        for a in self.pattern:
+            mask |= 1 << a
+        return set(op.index for op in self.task.operators
+                   if (op.add_mask | op.del_mask) & mask)
+
+    def compute_distances(self):
+        size = 1 << len(self.pattern)
+        distances = array('i', [-1]) * size
+        fringe = []
+        for s in range(size):
+            for pos, neg in self.goals:
+                if (s & pos) == pos and not (s & neg):
+                    distances[s] = 0
+                    fringe.append(s)
+                    break
+
+        depth = 0
+        while len(fringe) > 0:
+            depth += 1
+            next_fringe = []
+            for t in fringe:
+                for pre, neg, add, delete in self.operators:
+                    effect = add | delete
+                    if (t & add) != add or (t & delete):
+                        continue
+                    if (t & pre & ~effect) != (pre & ~effect) or (t & neg & ~effect):
+                        continue
+                    # Atoms set by the effect are free in the predecessor
+                    # unless the precondition fixes them
+                    base = (t & ~effect) | (pre & effect)
+                    free = effect & ~pre & ~neg
+                    sub = free
+                    while True:
+                        s = base | sub
+                        if distances[s] == -1:
+                            distances[s] = depth
+                            next_fringe.append(s)
+                        if sub == 0:
+                            break
+                        sub = (sub - 1) & free
+            fringe = next_fringe
+        return distances
+
+    def lookup(self, bits):
+        idx = 0
+        for i, a in enumerate(self.pattern):
+            if (bits >> a) & 1:
+                idx |= 1 << i
+        d = self.distances[idx]
+        return float('inf') if d == -1 else d
+
+    def fingerprint(self):
+        """
+        Returns a digest of the pattern atoms, the projected operators and
+        the projected goal, which fully determine the distance table
+        """
+        content = json.dumps([[list(self.task.atoms.keys[a]) for a in self.pattern],
+                              self.operators, self.goals])
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            header = {"fingerprint": self.fingerprint(), "size": len(self.distances)}
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            self.distances.tofile(f)
+
+    @staticmethod
+    def load(task: GroundedTask, pattern, path):
+        """
+        Loads the distance table of the pattern from a file written by save,
+        or returns None if the file does not match the projected task
+        """
+        pdb = PatternDatabase(task, pattern, array('i'))
+        with open(path, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            if header["fingerprint"] != pdb.fingerprint():
+                return None
+            pdb.distances.fromfile(f, header["size"])
+        return pdb
+
+
+class CanonicalPDBHeuristic:
+    """
+    Admissible combination of several pattern databases. Two patterns are
+    additive if no operator affects both, and the heuristic value is the
+    maximum over the maximal sets of pairwise additive patterns of the sum
+    of their lookups. By default the goal atoms are split into patterns of
+    pattern_size atoms. With a cache_dir, tables are stored under their
+    fingerprint and reused by later problems with the same projections,
+    and the least recently used files are removed once the directory takes
+    more than max_size bytes.
+    """
+
+    def __init__(self, problem: Problem, patterns=None, pattern_size=4, cache_dir=None,
+                 max_size=1 << 30):
+        self.task = get_task(problem)
+        if patterns is None:
+            goal = self.task.goal_atoms()
+            patterns = [goal[i:i + pattern_size] for i in range(0, len(goal), pattern_size)]
+        self.pdbs = [self.build(p, cache_dir) for p in patterns]
+        if cache_dir is not None:
+            evict(cache_dir, max_size, [pdb.fingerprint() + ".pdb" for pdb in self.pdbs])
+
+        affected = [pdb.affected() for pdb in self.pdbs]
+        n = len(self.pdbs)
+        additive = [set(j for j in range(n) if j != i and affected[i].isdisjoint(affected[j]))
+                    for i in range(n)]
+        self.cliques = maximal_cliques(additive)
+
+    def build(self, pattern, cache_dir):
+        if cache_dir is None:
+            return PatternDatabase(self.task, pattern)
+        pdb = PatternDatabase(self.task, pattern, array('i'))
+        path = os.path.join(cache_dir, pdb.fingerprint() + ".pdb")
+        if os.path.exists(path):
+            try:
+                loaded = PatternDatabase.load(self.task, pattern, path)
+                if loaded is not None:
+                    os.utime(path)  # Marks the table as recently used for cache eviction
+                    return loaded
+            except (OSError, ValueError, KeyError, EOFError):
+                pass  # Unreadable, truncated or evicted entry, computed again below
+        pdb.distances = pdb.compute_distances()
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(path, pdb.save)
+        return pdb
+
+    def __call__(self, state):
+        bits = self.task.encode(state)
+        values = [pdb.lookup(bits) for pdb in self.pdbs]
+        best = 0
+        for clique in self.cliques:
+            best = max(best, sum([values[i] for i in clique]))
+        return best
+
+
+def maximal_cliques(neighbours):
+    """
+    Returns the maximal cliques of a graph given as a list of neighbour sets
+    """
+    cliques = []
+    stack = [(set(), set(range(len(neighbours))), set())]
+    while len(stack) > 0:
+        r, p, x = stack.pop()
+        if len(p) == 0 and len(x) == 0:
+            cliques.append(sorted(r))
+            continue
+        for v in list(p):
+            stack.append((r | {v}, p & neighbours[v], x & neighbours[v]))
+            p = p - {v}
+            x = x | {v}
+    return cliques
@@ -0,0 +1,178 @@
+from ..strips import Problem
+from .search import search_plan
+from .graphplan import graph_plan
+from .heuristics import ff_heuristic
+from .landmarks import landmark_count, lmcut
+import multiprocessing
+import queue
+import time
+
+try:
+    import resource
+except ImportError:  # Memory limits are only available on Unix
+    resource = None
+
+
+def portfolio_plan(problem: Problem, configs=None, time_limit=None, best=False):
+    """
+    Runs several solver configurations concurrently and returns the first
+    plan found, or with best=True the shortest plan found by all of them
+    within time_limit seconds. Returns None if no configuration succeeds.
+    """
+    plan = None
+    for result in run_portfolio(problem, configs, time_limit):
+        if result.plan is None:
+            continue
+        if not best:
+            return result.plan
+        if plan is None or plan_length(result.plan) < plan_length(plan):
+            plan = result.plan
+    return plan
+
+
+class SolverConfig:
+    """
+    A named solver configuration. The solve function is called with the
+    problem in a separate process and returns a plan or None. The time
+    limit is in seconds and the memory limit in megabytes.
+    """
+
+    def __init__(self, name, solve, time_limit=None, memory_limit=None):
+        self.name = name
+        self.solve = solve
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+
+    def __repr__(self) -> str:
+        return "SolverConfig({})".format(self.name)
+
+
+class PortfolioResult:
+    def __init__(self, name, plan, time, error=None):
+        self.name = name
+        self.plan = plan
+        self.time = time
+        self.error = error
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            outcome = "error: " + self.error
+        elif self.plan is None:
+            outcome = "no plan"
+        else:
+            outcome = "{} actions".format(plan_length(self.plan))
+        return "PortfolioResult({}, {:.3f}s, {})".format(self.name, self.time, outcome)
+
+
+def solve_graphplan(problem):
+    return graph_plan(problem)
+
+
+def solve_gbfs_ff(problem):
+    return search_plan(problem, ff_heuristic(problem), "gbfs", preferred=True)
+
+
+def solve_lazy_gbfs_landmarks(problem):
+    return search_plan(problem, landmark_count(problem), "gbfs", lazy=True)
+
+
+def solve_astar_lmcut(problem):
+    return search_plan(problem, lmcut(problem), "astar")
+
+
+def default_configs():
+    return [SolverConfig("gbfs-ff", solve_gbfs_ff),
+            SolverConfig("lazy-gbfs-landmarks", solve_lazy_gbfs_landmarks),
+            SolverConfig("astar-lmcut", solve_astar_lmcut),
+            SolverConfig("graphplan", solve_graphplan)]
+
+
+def run_portfolio(problem: Problem, configs=None, time_limit=None, poll_interval=0.1):
+    """
+    Starts every configuration in its own process and yields a
+    PortfolioResult for each of them as they finish. Configurations that
+    exceed their own time limit or the overall time_limit are killed and
+    reported with an error, as are those that fail or run out of memory.
+    All processes still running are killed when the generator is closed.
+    """
+    if configs is None:
+        configs = default_configs()
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    start = time.time()
+    running = dict()
+    for i, config in enumerate(configs):
+        p = context.Process(target=run_config, args=(i, config, problem, results), daemon=True)
+        p.start()
+        running[i] = p
+
+    try:
+        while len(running) > 0:
+            try:
+                i, plan, error, elapsed = results.get(timeout=poll_interval)
+            except queue.Empty:
+                pass
+            else:
+                running.pop(i).join()
+                yield PortfolioResult(configs[i].name, plan, elapsed, error)
+                continue
+
+            now = time.time() - start
+            if time_limit is not None and now > time_limit:
+                for i in list(running):
+                    kill(running.pop(i))
+                    yield PortfolioResult(configs[i].name, None, now, "time limit")
+                break
+            for i in list(running):
+                if configs[i].time_limit is not None and now > configs[i].time_limit:
+                    kill(running.pop(i))
+                    yield PortfolioResult(configs[i].name, None, now, "time limit")
+
+            # Results of processes that already exited are in the queue,
+            # so a process without one after draining it has crashed
+            dead = [i for i, p in running.items() if not p.is_alive()]
+            while True:
+                try:
+                    i, plan, error, elapsed = results.get_nowait()
+                except queue.Empty:
+                    break
+                running.pop(i).join()
+                yield PortfolioResult(configs[i].name, plan, elapsed, error)
+            for i in dead:
+                if i in running:
+                    p = running.pop(i)
+                    yield PortfolioResult(configs[i].name, None, time.time() - start,
+                                          "exit code {}".format(p.exitcode))
+    finally:
+        for p in running.values():
+            kill(p)
+
+
+def run_config(i, config: SolverConfig, problem: Problem, results):
+    if config.memory_limit is not None and resource is not None:
+        limit = config.memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    start = time.time()
+    try:
+        plan = config.solve(problem)
+        error = None
+    except MemoryError:
+        plan, error = None, "memory limit"
+    except Exception as e:
+        plan, error = None, "{}: {}".format(type(e).__name__, e)
+    results.put((i, plan, error, time.time() - start))
+
+
+def kill(process):
+    process.kill()
+    process.join()
+
+
+def plan_length(plan):
+    """
+    Returns the number of actions of a sequential plan or of a
+    GraphPlan plan given as a dict of action sets per level
+    """
+    if isinstance(plan, dict):
+        return sum([len(actions) for actions in plan.values()])
+    return len(plan)
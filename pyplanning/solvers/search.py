@@ -1,40 +1,320 @@
-from ..strips import KnowledgeState, Problem
-import itertools
+from ..strips import Problem
+from ..grounding import GroundedTask, get_task
 from ..utils import PriorityQueue
 from .heuristics import null_heuristic
+from .search_space import SearchSpace
+from .successors import get_successor_generator
+from concurrent.futures import ProcessPoolExecutor
+import time
 
+algorithms = {"astar", "wastar", "gbfs", "ucs"}
 
-def search_plan(problem: Problem, heuristic=null_heuristic):
-    return __asearch(problem, problem.initial_state, heuristic)
 
+def search_plan(problem: Problem, heuristic=null_heuristic, algorithm="astar", weight=1,
+                lazy=False, preferred=False, boost=1000, workers=None, batch_size=64):
+    """
+    Best-first search over the compiled task of the problem.
+    Supported algorithms are A* ("astar"), weighted A* ("wastar") with
+    f = g + weight * h, greedy best-first ("gbfs") with f = h and
+    uniform-cost search ("ucs") with f = g. Ties are broken on lower h.
 
-def __asearch(problem: Problem, start_state, heuristic=null_heuristic):
-    visited = set()
-    fringe = PriorityQueue()
-    fringe.push((start_state, []), heuristic(start_state))
+    With lazy=True successors are queued with the heuristic value of their
+    parent and only evaluated when they are expanded. With preferred=True
+    the heuristic must provide preferred_operators(state); successors
+    reached by preferred operators are also kept in a second queue that
+    is given `boost` extra expansions whenever the best h improves.
+
+    With workers set, up to batch_size nodes are popped at a time and
+    their successors are generated and evaluated in a process pool.
+    The task and heuristic are sent to every worker once, so the
+    heuristic must be picklable unless processes are forked.
+    """
+    if algorithm not in algorithms:
+        raise ValueError("Unknown search algorithm: {}".format(algorithm))
+    if algorithm == "astar":
+        weight = 1
+    if algorithm == "ucs":
+        heuristic = null_heuristic
+    if preferred and not hasattr(heuristic, "preferred_operators"):
+        raise TypeError("Heuristic does not provide preferred operators.")
+    task = get_task(problem)
+    if workers is not None:
+        if lazy:
+            raise ValueError("Lazy evaluation is not supported with parallel search.")
+        return __parallel_search(task, task.init, heuristic, algorithm, weight, preferred, boost,
+                                 workers, batch_size)
+    if lazy:
+        return __lazy_search(task, task.init, heuristic, algorithm, weight, preferred, boost)
+    return __best_first_search(task, task.init, heuristic, algorithm, weight, preferred, boost)
+
+
+def anytime_plan(problem: Problem, heuristic=null_heuristic, weights=(5, 3, 2, 1.5, 1),
+                 time_limit=None):
+    """
+    Restarting weighted A*. Yields successively shorter plans, searching
+    again with the next weight after each plan and pruning every node with
+    g + h not below the length of the last plan. With an admissible
+    heuristic the search stops once no shorter plan exists, the last plan
+    being optimal. Stops after time_limit seconds.
+    """
+    task = get_task(problem)
+    deadline = None if time_limit is None else time.time() + time_limit
+    bound = float('inf')
+    i = 0
+    while deadline is None or time.time() < deadline:
+        plan = __best_first_search(task, task.init, heuristic, "wastar", weights[i],
+                                   bound=bound, deadline=deadline)
+        if plan is None:
+            return
+        bound = len(plan)
+        yield plan
+        i = min(i + 1, len(weights) - 1)
+
+
+def __best_first_search(task: GroundedTask, start_bits, heuristic, algorithm, weight,
+                        preferred=False, boost=1000, bound=float('inf'), deadline=None):
+    successors = get_successor_generator(task)
+    space = SearchSpace()
+    fringe = AlternationQueue(2 if preferred else 1)
+    h_values = {}
+    # Preferred operators are taken right after the evaluation of a node,
+    # while the heuristic still holds them, and used when it is expanded
+    preferred_of = {}
+
+    start = space.register(start_bits)
+    h_values[start] = heuristic(task.state(start_bits))
+    if preferred:
+        preferred_of[start] = get_preferred(heuristic, task, start_bits)
+    best_h = h_values[start]
+    fringe.push(start, priority(algorithm, weight, 0, h_values[start]))
 
     while len(fringe) > 0:
-        s, plan = fringe.pop()
-        if s in visited:
+        node = fringe.pop()
+        if space.is_closed(node):
             continue
-        visited.add(s)
-        if problem.check_goal(s):
-            return plan
-
-        for a, next_ks in __generate_next_states(problem, s):
-            if next_ks not in visited:
-                new_plan = plan + [a]
-                fringe.push((next_ks, new_plan), heuristic(next_ks))
+        space.close(node)
+        bits = space.states[node]
+        if task.is_goal(bits):
+            return extract_plan(task, space, node)
+        if deadline is not None and time.time() > deadline:
+            return None
+
+        preferred_ops = preferred_of.get(node, ())
+        g = space.g[node] + 1
+        for op in successors.applicable(bits):
+            next_bits = op.apply(bits)
+            next_node = space.lookup(next_bits)
+            if next_node is None:
+                next_node = space.register(next_bits, node, op.index, g)
+                h = heuristic(task.state(next_bits))
+                h_values[next_node] = h
+                if preferred and h != float('inf'):
+                    preferred_of[next_node] = get_preferred(heuristic, task, next_bits)
+                if h < best_h:
+                    best_h = h
+                    fringe.boost(boost)
+            elif g < space.g[next_node] and algorithm != "gbfs":
+                # Cheaper path found, reopen the node
+                space.update(next_node, node, op.index, g)
+                space.reopen(next_node)
+                h = h_values[next_node]
+            else:
+                continue
+            if h == float('inf') or g + h >= bound:
+                continue
+            fringe.push(next_node, priority(algorithm, weight, g, h), op.index in preferred_ops)
     return None
 
 
-def __generate_next_states(problem: Problem, state: KnowledgeState):
-    next_states = []
-    for a_name, a in problem.domain.actions.items():
-        for objs in itertools.product(*[problem.get_typed_objs(t) for t in a.types]):
-            if len(set(objs)) != len(objs):
-                continue
-            res, next_ks = a.take_action(state, objs)
-            if res:
-                next_states.append((a.ground(objs), next_ks))
-    return next_states
+def __lazy_search(task: GroundedTask, start_bits, heuristic, algorithm, weight,
+                  preferred=False, boost=1000):
+    successors = get_successor_generator(task)
+    space = SearchSpace()
+    fringe = AlternationQueue(2 if preferred else 1)
+    best_h = float('inf')
+
+    # Fringe entries are (parent node, operator id), with the root as (-1, -1)
+    fringe.push((-1, -1), 0)
+    while len(fringe) > 0:
+        parent, op = fringe.pop()
+        if parent == -1:
+            bits = start_bits
+            g = 0
+        else:
+            bits = task.operators[op].apply(space.states[parent])
+            g = space.g[parent] + 1
+
+        # Nodes are only registered when expanded, so a known node is closed
+        node = space.lookup(bits)
+        if node is None:
+            node = space.register(bits, parent, op, g)
+        elif algorithm == "gbfs" or g >= space.g[node]:
+            continue
+        else:
+            space.update(node, parent, op, g)
+        space.close(node)
+
+        if task.is_goal(bits):
+            return extract_plan(task, space, node)
+        h = heuristic(task.state(bits))
+        if h == float('inf'):
+            continue
+        if h < best_h:
+            best_h = h
+            fringe.boost(boost)
+
+        preferred_ops = get_preferred(heuristic, task, bits) if preferred else ()
+        for next_op in successors.applicable(bits):
+            fringe.push((node, next_op.index), priority(algorithm, weight, g + 1, h),
+                        next_op.index in preferred_ops)
+    return None
+
+
+def __parallel_search(task: GroundedTask, start_bits, heuristic, algorithm, weight,
+                      preferred, boost, workers, batch_size):
+    space = SearchSpace()
+    fringe = AlternationQueue(2 if preferred else 1)
+    h_values = {}
+    # Preferred operators are taken right after the evaluation of a node,
+    # while the heuristic still holds them, and used when it is expanded
+    preferred_of = {}
+
+    start = space.register(start_bits)
+    h_values[start] = heuristic(task.state(start_bits))
+    if preferred:
+        preferred_of[start] = get_preferred(heuristic, task, start_bits)
+    best_h = h_values[start]
+    fringe.push(start, priority(algorithm, weight, 0, h_values[start]))
+
+    # Built before the workers start so that they receive it with the task
+    get_successor_generator(task)
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(task, heuristic, preferred)) as executor:
+        while len(fringe) > 0:
+            batch = []
+            goal = None
+            while len(fringe) > 0 and len(batch) < batch_size:
+                node = fringe.pop()
+                if space.is_closed(node):
+                    continue
+                space.close(node)
+                if task.is_goal(space.states[node]):
+                    goal = node
+                    break
+                batch.append((node, space.states[node]))
+            if goal is not None and len(batch) == 0:
+                return extract_plan(task, space, goal)
+
+            # Nodes popped before a goal may still have successors with a
+            # lower priority, so the goal is only returned if none has one
+            lowest = None
+
+            chunks = [batch[i::workers] for i in range(min(workers, len(batch)))]
+            for results in executor.map(expand_batch, chunks):
+                for node, successors, preferred_ops in results:
+                    g = space.g[node] + 1
+                    for op, next_bits, h in successors:
+                        next_node = space.lookup(next_bits)
+                        if next_node is None:
+                            next_node = space.register(next_bits, node, op, g)
+                            h_values[next_node] = h
+                            if h < best_h:
+                                best_h = h
+                                fringe.boost(boost)
+                        elif g < space.g[next_node] and algorithm != "gbfs":
+                            space.update(next_node, node, op, g)
+                            space.reopen(next_node)
+                        else:
+                            continue
+                        if h == float('inf'):
+                            continue
+                        p = priority(algorithm, weight, g, h)
+                        if lowest is None or p < lowest:
+                            lowest = p
+                        fringe.push(next_node, p, op in preferred_ops)
+
+            if goal is not None:
+                goal_priority = priority(algorithm, weight, space.g[goal], h_values[goal])
+                if lowest is None or lowest >= goal_priority:
+                    return extract_plan(task, space, goal)
+                space.reopen(goal)
+                fringe.push(goal, goal_priority)
+    return None
+
+
+# State of a parallel search worker process, set by init_worker
+worker_state = dict()
+
+
+def init_worker(task, heuristic, preferred):
+    worker_state["task"] = task
+    worker_state["heuristic"] = heuristic
+    worker_state["preferred"] = preferred
+    worker_state["successors"] = get_successor_generator(task)
+
+
+def expand_batch(batch):
+    """
+    Generates the successors of a batch of (node, bits) pairs in a worker
+    process and evaluates the heuristic on each of them
+    """
+    task = worker_state["task"]
+    heuristic = worker_state["heuristic"]
+    results = []
+    for node, bits in batch:
+        preferred_ops = ()
+        if worker_state["preferred"]:
+            preferred_ops = get_preferred(heuristic, task, bits)
+        successors = []
+        for op in worker_state["successors"].applicable(bits):
+            next_bits = op.apply(bits)
+            successors.append((op.index, next_bits, heuristic(task.state(next_bits))))
+        results.append((node, successors, set(preferred_ops)))
+    return results
+
+
+class AlternationQueue:
+    """
+    Alternates between a priority queue of all entries and, when two
+    queues are used, a queue of entries reached by preferred operators.
+    The queue with the fewest pops so far is used next, and boosting
+    credits the preferred queue with extra pops.
+    """
+
+    def __init__(self, num_queues=1):
+        self.queues = [PriorityQueue() for _ in range(num_queues)]
+        self.pops = [0] * num_queues
+
+    def __len__(self):
+        return sum([len(q) for q in self.queues])
+
+    def push(self, item, priority=0, preferred=False):
+        self.queues[0].push(item, priority)
+        if preferred and len(self.queues) > 1:
+            self.queues[1].push(item, priority)
+
+    def pop(self):
+        best = None
+        for i, q in enumerate(self.queues):
+            if len(q) > 0 and (best is None or self.pops[i] < self.pops[best]):
+                best = i
+        self.pops[best] += 1
+        return self.queues[best].pop()
+
+    def boost(self, amount):
+        if len(self.queues) > 1:
+            self.pops[1] -= amount
+
+
+def get_preferred(heuristic, task: GroundedTask, bits):
+    return heuristic.preferred_operators(task.state(bits))
+
+
+def priority(algorithm, weight, g, h):
+    if algorithm == "gbfs":
+        return (h, g)
+    return (g + weight * h, h)
+
+
+def extract_plan(task: GroundedTask, space: SearchSpace, node):
+    return [task.operators[op].ground() for op in space.trace_path(node)]
@@ -0,0 +1,62 @@
+from array import array
+
+
+class SearchSpace:
+    """
+    Registry of search nodes keyed on the state bitset. Each node is an
+    integer id with its parent id, the operator id that reached it and its
+    g-value stored in compact arrays, so plans are only reconstructed once
+    the goal is found.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+        self.states = []
+        self.parents = array('l')
+        self.operators = array('l')
+        self.g = array('l')
+        self.closed = bytearray()
+
+    def __len__(self):
+        return len(self.states)
+
+    def lookup(self, bits):
+        """
+        Returns the node id of the state, or None if it was never registered
+        """
+        return self.ids.get(bits)
+
+    def register(self, bits, parent=-1, op=-1, g=0):
+        node = len(self.states)
+        self.ids[bits] = node
+        self.states.append(bits)
+        self.parents.append(parent)
+        self.operators.append(op)
+        self.g.append(g)
+        self.closed.append(0)
+        return node
+
+    def update(self, node, parent, op, g):
+        self.parents[node] = parent
+        self.operators[node] = op
+        self.g[node] = g
+
+    def close(self, node):
+        self.closed[node] = 1
+
+    def reopen(self, node):
+        self.closed[node] = 0
+
+    def is_closed(self, node):
+        return self.closed[node] == 1
+
+    def trace_path(self, node):
+        """
+        Returns the operator ids on the path from the root to the node
+        """
+        path = []
+        while self.parents[node] != -1:
+            path.append(self.operators[node])
+            node = self.parents[node]
+        path.reverse()
+        return path
@@ -0,0 +1,83 @@
+from ..grounding import GroundedTask, mask_to_ids
+
+
+def get_successor_generator(task: GroundedTask):
+    """
+    Returns the successor generator of the task, building it on first use
+    """
+    if task.successor_generator is None:
+        task.successor_generator = SuccessorGenerator(task)
+    return task.successor_generator
+
+
+class SuccessorGenerator:
+    """
+    Decision tree over positive precondition atoms, built once from the
+    grounded operators of a task. Every operator sits at the end of the
+    path of its sorted preconditions, and each node has a child per atom
+    that comes next on some path, so a lookup only visits the children
+    whose atoms are true in the state.
+    """
+
+    def __init__(self, task: GroundedTask):
+        # Sorting groups operators by their preconditions, so the operators
+        # below a node form a contiguous range split by the atom at its depth
+        items = sorted([(tuple(sorted(op.pre)), op.index, op) for op in task.operators])
+        self.root = SuccessorNode()
+        stack = [(self.root, 0, len(items), 0)]
+        while len(stack) > 0:
+            node, lo, hi, depth = stack.pop()
+            while lo < hi and len(items[lo][0]) == depth:
+                node.operators.append(items[lo][2])
+                lo += 1
+            while lo < hi:
+                atom = items[lo][0][depth]
+                end = lo + 1
+                while end < hi and items[end][0][depth] == atom:
+                    end += 1
+                child = SuccessorNode()
+                node.children[atom] = child
+                stack.append((child, lo, end, depth + 1))
+                lo = end
+
+    def applicable(self, bits):
+        """
+        Returns the operators applicable in the state with the given bitset
+        """
+        true_ids = None
+        applicable = []
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            for op in node.operators:
+                if not op.neg or not op.violates_neg(bits):
+                    applicable.append(op)
+            children = node.children
+            # Narrow nodes test their atoms on the bitset, wide nodes are
+            # matched against the true atoms of the state, decoded once
+            if len(children) <= 64:
+                for atom, child in children.items():
+                    if (bits >> atom) & 1:
+                        stack.append(child)
+                continue
+            if true_ids is None:
+                true_ids = mask_to_ids(bits)
+                true_set = set(true_ids)
+            if len(children) <= len(true_ids):
+                for atom, child in children.items():
+                    if atom in true_set:
+                        stack.append(child)
+            else:
+                for atom in true_ids:
+                    child = children.get(atom)
+                    if child is not None:
+                        stack.append(child)
+        return applicable
+
+
+class SuccessorNode:
+    __slots__ = ("children", "operators")
+
+    def __init__(self):
+        self.children = dict()  # atom id -> child node
+        self.operators = []
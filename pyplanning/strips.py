@@ -23,6 +23,10 @@ class Domain:
         if len(self.actions) != len(actions):
             raise Warning("Actions with duplicate names were removed.")
 
+        # Domain-level analysis shared by all problems, computed on first use
+        self.schemas = None
+        self.constant_predicates = None
+
 
 class Problem:
     def __init__(self, name, domain, objects, initial_state, goal_state):
@@ -40,10 +44,28 @@ class Problem:
         self.initial_state = initial_state
         self.goal_state = goal_state
         self.objects = objects
+        self.task = None
+
+        if isinstance(initial_state, BitKnowledgeState):
+            self.atoms = initial_state.atoms
+        else:
+            self.atoms = AtomTable(domain.predicates)
 
     def check_goal(self, state):
         return state.query(self.goal_state)
 
+    def encode_state(self, state):
+        """
+        Returns the given state as a BitKnowledgeState over the
+        atom table of this problem
+        """
+        if isinstance(state, BitKnowledgeState) and state.atoms is self.atoms:
+            return state
+        if state.explicit_delete:
+            raise TypeError("States with explicit deletes cannot be encoded as bitsets.")
+        knowledge = [k for k in state.knowledge if isinstance(k, Predicate)]
+        return BitKnowledgeState(self.atoms, self.atoms.mask(knowledge))
+
     def get_typed_objs(self, t):
         all_types = self.domain.types.get_all_children(t)
         all_objs = []
@@ -106,3 +128,129 @@ class KnowledgeState:
 
     def __repr__(self):
         return str(self.knowledge)
+
+
+class AtomTable:
+    """
+    Interns grounded predicates to consecutive integer ids so that
+    states can be stored as integer bitsets
+    """
+
+    def __init__(self, predicates=None):
+        self.templates = dict(predicates) if predicates is not None else {}
+        self.ids = dict()
+        self.keys = []
+        self.predicates = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def key(pred):
+        return (pred.name,) + tuple(pred.grounding[v] for v in pred.variables)
+
+    def intern_key(self, key, pred=None):
+        idx = self.ids.get(key)
+        if idx is None:
+            idx = len(self.keys)
+            self.ids[key] = idx
+            self.keys.append(key)
+            self.predicates.append(pred)
+        return idx
+
+    def intern(self, pred):
+        if not pred.check_grounded():
+            raise TypeError("Only fully grounded predicates can be interned.")
+        return self.intern_key(self.key(pred), pred)
+
+    def find(self, pred):
+        try:
+            return self.ids.get(self.key(pred))
+        except KeyError:
+            return None  # Not fully grounded
+
+    def get_predicate(self, idx):
+        pred = self.predicates[idx]
+        if pred is None:
+            key = self.keys[idx]
+            pred = self.templates[key[0]].ground(key[1:])
+            self.predicates[idx] = pred
+        return pred
+
+    def mask(self, preds):
+        bits = 0
+        for p in preds:
+            bits |= 1 << self.intern(p)
+        return bits
+
+    def decode(self, bits):
+        preds = []
+        while bits:
+            low = bits & -bits
+            preds.append(self.get_predicate(low.bit_length() - 1))
+            bits ^= low
+        return preds
+
+
+class BitKnowledgeState(KnowledgeState):
+    """
+    KnowledgeState storing the set of true atoms as a Python int bitset
+    indexed by the ids of an AtomTable. States hash and compare on the
+    bitset alone, so they are only equal to states of the same table;
+    compare the knowledge of states of different kinds instead.
+    """
+
+    def __init__(self, atoms, bits=0):
+        self.atoms = atoms
+        self.bits = bits
+        self.explicit_delete = False
+
+    @property
+    def knowledge(self):
+        return frozenset(self.atoms.decode(self.bits))
+
+    def __eq__(self, o):
+        if isinstance(o, BitKnowledgeState):
+            return o.atoms is self.atoms and self.bits == o.bits
+        if isinstance(o, KnowledgeState):
+            return False
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.bits)
+
+    def teach(self, p):
+        if not isinstance(p, Iterable):
+            p = [p]
+        bits = self.bits
+
+        for prop in p:
+            if isinstance(prop, Predicate) and prop.check_grounded():
+                bits |= 1 << self.atoms.intern(prop)
+            elif isinstance(prop, NOT) and isinstance(prop.prop, Predicate) and prop.check_grounded():
+                idx = self.atoms.find(prop.prop)
+                if idx is not None:
+                    bits &= ~(1 << idx)
+            else:
+                raise TypeError("p must be a list of fully grounded Predicates.")
+        return BitKnowledgeState(self.atoms, bits)
+
+    def query(self, q):
+        if isinstance(q, Predicate) and q.check_grounded():
+            idx = self.atoms.find(q)
+            return idx is not None and bool((self.bits >> idx) & 1)
+        elif isinstance(q, AND):
+            for prop in q.props:
+                if not self.query(prop):
+                    return False
+            return True
+        elif isinstance(q, OR):
+            for prop in q.props:
+                if self.query(prop):
+                    return True
+            return False
+        elif isinstance(q, NOT):
+            return not self.query(q.prop)
+        else:
+            raise TypeError(
+                "Query must be a combination of fully grounded propositional classes.")
@@ -0,0 +1,205 @@
+from .logic import AND, NOT, OR
+from .strips import AtomTable, BitKnowledgeState, Problem
+from .grounding import GroundedOperator, GroundedTask, get_task, ids_to_mask, mask_to_ids
+from .pddl import load_domain, load_problem
+from .utils import atomic_write, evict, read_chunks, tokenize
+from array import array
+import hashlib
+import json
+import os
+import sys
+
+magic = "pyplanning-task"
+version = 1
+
+# Integer sections of a task file, each stored as an array of 32 bit ints.
+# Lists of variable length are stored as an offsets and a data section.
+sections = ["atom_offsets", "atom_data", "init",
+            "goal_pos_offsets", "goal_pos_data", "goal_neg_offsets", "goal_neg_data",
+            "op_names", "op_obj_offsets", "op_obj_data",
+            "op_pre_offsets", "op_pre_data", "op_neg_offsets", "op_neg_data",
+            "op_add_offsets", "op_add_data", "op_del_offsets", "op_del_data"]
+
+
+def load_compiled(domain_file, problem_file, cache_dir, max_size=1 << 30):
+    """
+    Loads a domain and problem like load_pddl, reusing the compiled task
+    from a cache directory. Tasks are stored under a hash of the tokens of
+    both files, so changes to comments or layout still hit the cache. On a
+    hit only the domain file is parsed. After every load, the least
+    recently used files are removed once the cache takes more than
+    max_size bytes; this includes pattern databases if the same directory
+    is given as the cache_dir of pdb_heuristic.
+    """
+    path = os.path.join(cache_dir, content_hash(domain_file, problem_file) + ".task")
+    domain = load_domain(domain_file)
+    if os.path.exists(path):
+        try:
+            problem = load_task(domain, path)
+        except (OSError, ValueError, KeyError, IndexError):
+            pass  # Unreadable, outdated or evicted entry, compiled again below
+        else:
+            try:
+                os.utime(path)
+            except OSError:
+                pass  # Evicted by another process since it was read
+            evict(cache_dir, max_size, [os.path.basename(path)])
+            return domain, problem
+
+    problem = load_problem(domain, problem_file)
+    get_task(problem)
+    os.makedirs(cache_dir, exist_ok=True)
+    atomic_write(path, lambda tmp_path: save_task(problem, tmp_path))
+    evict(cache_dir, max_size, [os.path.basename(path)])
+    return domain, problem
+
+
+def content_hash(*files):
+    """
+    Returns a digest of the tokens of the given PDDL files
+    """
+    digest = hashlib.sha256("{} {}".format(magic, version).encode("utf-8"))
+    for path in files:
+        with open(path, "r") as f:
+            for token, _, _ in tokenize(read_chunks(f)):
+                digest.update(token.encode("utf-8"))
+                digest.update(b" ")
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def save_task(problem: Problem, path):
+    """
+    Writes the compiled task of a problem to a binary file. The file is a
+    JSON header line holding the string table, the objects by type and
+    the location of every section, followed by the int arrays of the atoms,
+    the initial state, the goal and the operators.
+    """
+    task = get_task(problem)
+    strings = dict()
+
+    def string_id(s):
+        idx = strings.get(s)
+        if idx is None:
+            idx = len(strings)
+            strings[s] = idx
+        return idx
+
+    data = dict()
+    data["atom_offsets"], data["atom_data"] = to_csr(
+        [[string_id(s) for s in key] for key in task.atoms.keys])
+    data["init"] = array('i', mask_to_ids(task.init))
+    data["goal_pos_offsets"], data["goal_pos_data"] = to_csr([mask_to_ids(pos) for pos, _ in task.goals])
+    data["goal_neg_offsets"], data["goal_neg_data"] = to_csr([mask_to_ids(neg) for _, neg in task.goals])
+    ops = task.operators
+    data["op_names"] = array('i', [string_id(op.name) for op in ops])
+    data["op_obj_offsets"], data["op_obj_data"] = to_csr([[string_id(o) for o in op.objects] for op in ops])
+    data["op_pre_offsets"], data["op_pre_data"] = to_csr([op.pre for op in ops])
+    data["op_neg_offsets"], data["op_neg_data"] = to_csr([op.neg for op in ops])
+    data["op_add_offsets"], data["op_add_data"] = to_csr([op.add for op in ops])
+    data["op_del_offsets"], data["op_del_data"] = to_csr([op.delete for op in ops])
+
+    objects = [[t, [string_id(o) for o in objs]] for t, objs in problem.objects.items()]
+    header = {"magic": magic, "version": version, "byteorder": sys.byteorder,
+              "domain": problem.domain.name, "problem": problem.name,
+              "objects": objects, "strings": list(strings), "sections": {}}
+    offset = 0
+    for name in sections:
+        header["sections"][name] = [offset, len(data[name])]
+        offset += len(data[name]) * data[name].itemsize
+
+    header_bytes = (json.dumps(header) + "\n").encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(header_bytes)
+        # Pad so that the arrays start on an 8 byte boundary
+        f.write(b" " * (-len(header_bytes) % 8))
+        for name in sections:
+            data[name].tofile(f)
+
+
+def load_task(domain, path):
+    """
+    Loads a problem and its compiled task from a file written by save_task.
+    This skips parsing and grounding, but it is plain deserialization:
+    the whole file is read and the atom table, the masks and every
+    operator are rebuilt from it before the problem is returned.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    header_end = content.find(b"\n") + 1
+    if header_end == 0:
+        raise ValueError("{} is not a compiled task file.".format(path))
+    header = json.loads(content[:header_end].decode("utf-8"))
+    if header.get("magic") != magic or header.get("version") != version:
+        raise ValueError("{} is not a compiled task file.".format(path))
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Compiled task file was written with a different byte order.")
+    if header["domain"] != domain.name:
+        raise ValueError("Compiled task does not belong to the domain {}.".format(domain.name))
+
+    start = header_end + (-header_end % 8)
+    view = memoryview(content)
+    data = dict()
+    for name in sections:
+        offset, length = header["sections"][name]
+        begin = start + offset
+        if begin + 4 * length > len(content):
+            raise ValueError("Compiled task file {} is truncated.".format(path))
+        data[name] = view[begin:begin + 4 * length].cast('i')
+    strings = header["strings"]
+
+    atoms = AtomTable(domain.predicates)
+    for key in from_csr(data["atom_offsets"], data["atom_data"]):
+        atoms.intern_key(tuple(strings[s] for s in key))
+    init = ids_to_mask(data["init"])
+    goals = [(ids_to_mask(pos), ids_to_mask(neg)) for pos, neg in zip(
+        from_csr(data["goal_pos_offsets"], data["goal_pos_data"]),
+        from_csr(data["goal_neg_offsets"], data["goal_neg_data"]))]
+
+    operators = []
+    for i, objs, pre, neg, add, delete in zip(
+            data["op_names"],
+            from_csr(data["op_obj_offsets"], data["op_obj_data"]),
+            from_csr(data["op_pre_offsets"], data["op_pre_data"]),
+            from_csr(data["op_neg_offsets"], data["op_neg_data"]),
+            from_csr(data["op_add_offsets"], data["op_add_data"]),
+            from_csr(data["op_del_offsets"], data["op_del_data"])):
+        name = strings[i]
+        if name not in domain.actions:
+            raise ValueError("Compiled task uses the unknown action {}.".format(name))
+        operators.append(GroundedOperator(len(operators), name, [strings[o] for o in objs],
+                                          pre, neg, add, delete, domain.actions[name]))
+
+    objects = {t: [strings[o] for o in objs] for t, objs in header["objects"]}
+    problem = Problem(header["problem"], domain, objects, BitKnowledgeState(atoms, init),
+                      goal_proposition(atoms, goals))
+    problem.task = GroundedTask(atoms, operators, init, goals)
+    return problem
+
+
+def goal_proposition(atoms, goals):
+    """
+    Returns the goal of a task as a disjunction of conjunctions of literals
+    """
+    conjunctions = []
+    for pos, neg in goals:
+        literals = [atoms.get_predicate(a) for a in mask_to_ids(pos)]
+        literals += [NOT(atoms.get_predicate(a)) for a in mask_to_ids(neg)]
+        conjunctions.append(AND(literals))
+    if len(conjunctions) == 1:
+        return conjunctions[0]
+    return OR(conjunctions)
+
+
+def to_csr(lists):
+    offsets = array('i', [0])
+    data = array('i')
+    for items in lists:
+        data.extend(items)
+        offsets.append(len(data))
+    return offsets, data
+
+
+def from_csr(offsets, data):
+    for i in range(len(offsets) - 1):
+        yield data[offsets[i]:offsets[i + 1]]
@@ -1,24 +1,112 @@
 import heapq
+import os
+import re
+
+
+token_pattern = re.compile(r"[()]|;[^\n]*|[^\s();]+|\n")
+token_delimiters = {"(", ")", "\n"}
+
+
+def read_chunks(f, size=1 << 16):
+    """
+    Yields the content of an open text file in chunks of size characters
+    """
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def atomic_write(path, writer):
+    """
+    Calls writer with a temporary path next to path and moves the written
+    file into place, so that other processes never see a partial file
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        writer(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def evict(cache_dir, max_size, recent=()):
+    """
+    Removes the least recently modified files of a cache directory until
+    the remaining ones take at most max_size bytes. The names in recent,
+    files just used by the caller, are removed last since modification
+    times are too coarse to order files touched in quick succession.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".tmp") or not os.path.isfile(path):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # Evicted by another process
+        entries.append((name in recent, st.st_mtime, st.st_size, name))
+    total = sum([size for _, _, size, _ in entries])
+    for _, _, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass  # Already evicted by another process
+        total -= size
+
+
+def tokenize(chunks):
+    """
+    Splits PDDL text given as an iterable of chunks into parentheses and
+    words, dropping comments. Words and comments cut at the end of a chunk
+    are carried over to the next one. Yields (token, line, column) tuples
+    with 1-based positions.
+    """
+    line = 1
+    line_start = 0  # Offset of the current line in the text
+    base = 0  # Offset of the buffer in the text
+    rest = ""
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        buffer = rest if chunk is None else rest + chunk
+        keep = len(buffer)
+        for m in token_pattern.finditer(buffer):
+            token = m.group()
+            if chunk is not None and m.end() == len(buffer) and token not in token_delimiters:
+                keep = m.start()
+                break
+            if token == "\n":
+                line += 1
+                line_start = base + m.end()
+            elif token[0] != ";":
+                yield token, line, base + m.start() - line_start + 1
+        if chunk is None:
+            return
+        rest = buffer[keep:]
+        base += keep
 
 
 class TextTree:
-    def __init__(self, text):
+    """
+    Tree of the parenthesized expressions of a PDDL file, built in a single
+    pass over its tokens. The root is the outermost expression; the text of
+    each node holds the words directly inside it, separated by spaces.
+    """
+
+    def __init__(self, text=None, tokens=None):
         self.raw_text = text
-        self.root = TextTreeNode(None)
-        start_idx = text.find("(")
-        self.process(self.root, text[start_idx+1:])
-
-    def process(self, node, text):
-        for i, c in enumerate(text):
-            if c == "(":
-                new_node = TextTreeNode(node)
-                node.add_child(new_node)
-                return self.process(new_node, text[i+1:])
-            elif c == ")":
-                if node.parent is not None:
-                    return self.process(node.parent, text[i+1:])
-            else:
-                node.append(c)
+        if tokens is None:
+            tokens = tokenize([text])
+        self.root = parse_tree(iter(tokens))
 
     def print(self):
         self.__print_tree(self.root, 0)
@@ -29,9 +117,59 @@ class TextTree:
             self.__print_tree(child, level+1)
 
 
+def parse_tree(tokens):
+    """
+    Builds the tree of the single expression making up the token stream
+    """
+    root = None
+    for token, line, column in tokens:
+        if token != "(":
+            raise SyntaxError("Expected '(' but found '{}' at line {}, column {}.".format(
+                token, line, column))
+        root = TextTreeNode(None, line, column)
+        break
+    if root is None:
+        raise SyntaxError("Empty PDDL file.")
+    parse_expression(tokens, root)
+    expect_end(tokens)
+    return root
+
+
+def parse_expression(tokens, root, words=()):
+    """
+    Reads the tokens of the expression opened by root up to its closing
+    parenthesis with an explicit stack of open nodes. The words already
+    read from the expression can be given in words.
+    """
+    node = root
+    stack = [list(words)]
+    for token, line, column in tokens:
+        if token == "(":
+            child = TextTreeNode(node, line, column)
+            node.add_child(child)
+            stack.append([])
+            node = child
+        elif token == ")":
+            node.text = " ".join(stack.pop())
+            if node is root:
+                return root
+            node = node.parent
+        else:
+            stack[-1].append(token)
+    raise SyntaxError("Unclosed '(' at {}.".format(node.location()))
+
+
+def expect_end(tokens):
+    for token, line, column in tokens:
+        raise SyntaxError("Unexpected '{}' after the end of the expression at line {}, column {}.".format(
+            token, line, column))
+
+
 class TextTreeNode:
-    def __init__(self, parent):
+    def __init__(self, parent, line=None, column=None):
         self.parent = parent
+        self.line = line
+        self.column = column
         self.text = ""
         self.children = []
 
@@ -41,6 +179,9 @@ class TextTreeNode:
     def add_child(self, child):
         self.children.append(child)
 
+    def location(self):
+        return "line {}, column {}".format(self.line, self.column)
+
 
 class PriorityQueue:
     def __init__(self):